@@ -0,0 +1,415 @@
+"""أدوات قياس أداء البوت
+
+الاستخدام:
+    python benchmark.py webhook http://127.0.0.1:8443/telegram 500
+    python benchmark.py replay --keywords 10,1000,10000,100000 --updates 5000
+    python benchmark.py replay --keywords 1000 --updates-file updates.jsonl
+
+webhook: يرسل تحديثات تركيبية إلى خادم الـ webhook مع ترويسة السر (نفس WEBHOOK_SECRET
+المستخدم في تشغيل البوت، وإلا رفض الخادم كل الطلبات)، ويطبع زمن
+الاستجابة (p50 / p99) وعدد التحديثات في الثانية. الخادم يرد قبل المعالجة، فلقياس زمن
+المعالجة الكامل شغّل البوت مع WEBHOOK_WAIT_FOR_PROCESSING=1.
+
+replay: يبني التطبيق الحقيقي بـ Bot وهمي يسجل الطلبات بدلاً من إرسالها، ويعيد تشغيل
+تحديثات (تركيبية أو مسجلة) على قاعدة بيانات بعدد كلمات محدد. كل حجم يعمل في عملية
+مستقلة في مجلد مؤقت، والنتائج تُضاف إلى benchmarks/results.jsonl للمقارنة بين التعديلات.
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(REPO_DIR, "benchmarks", "results.jsonl")
+
+def make_update(update_id, text, chat_id=1000, user_id=1000):
+    """تحديث رسالة نصية تركيبي بصيغة Bot API"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": text
+        }
+    }
+
+def make_command(update_id, command, chat_id=1000, user_id=1000):
+    """تحديث أمر (/stats مثلاً) مع كيان bot_command"""
+    update = make_update(update_id, command, chat_id, user_id)
+    name = command.split()[0]
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(name)}]
+    return update
+
+def make_sticker(update_id, file_id, chat_id=1000, user_id=1000):
+    """تحديث ملصق تركيبي"""
+    update = make_update(update_id, None, chat_id, user_id)
+    del update["message"]["text"]
+    update["message"]["sticker"] = {
+        "file_id": file_id, "file_unique_id": f"u{file_id}", "width": 512, "height": 512,
+        "is_animated": False, "is_video": False, "type": "regular"
+    }
+    return update
+
+def percentile(values, fraction):
+    """النسبة المئوية من قائمة مرتبة"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(name, latencies, elapsed):
+    """طباعة ملخص القياس"""
+    latencies = sorted(latencies)
+    print(f"• {name}: {len(latencies)} تحديث في {elapsed:.2f} ثانية")
+    print(f"  الإنتاجية: {len(latencies) / elapsed if elapsed else 0:.1f} تحديث/ثانية")
+    print(f"  p50: {percentile(latencies, 0.50) * 1000:.2f}ms | p99: {percentile(latencies, 0.99) * 1000:.2f}ms")
+
+# ========== قياس الـ webhook ==========
+async def webhook_probe(url, count, concurrency=8, secret=None):
+    """إرسال تحديثات إلى الـ webhook وقياس زمن كل طلب"""
+    import httpx
+
+    secret = secret if secret is not None else os.environ.get("WEBHOOK_SECRET", "")
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    latencies = []
+    failures = 0
+    queue = asyncio.Queue()
+    for i in range(1, count + 1):
+        # محادثات متعددة حتى يظهر أثر المعالجة المتوازية
+        queue.put_nowait(make_update(i, f"مرحبا {i}", chat_id=1000 + i % concurrency))
+
+    async def worker(client):
+        nonlocal failures
+        while not queue.empty():
+            payload = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post(url, content=json.dumps(payload), headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    report("webhook", latencies, elapsed)
+    if failures:
+        print(f"  ⚠️ طلبات فاشلة: {failures}")
+    return latencies, elapsed
+
+# ========== إعادة تشغيل التحديثات بدون اتصال ==========
+ARABIC_LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+def make_keywords(count, rng):
+    """كلمات مفتاحية تركيبية مختلفة (كلمة أو كلمتان من حروف عربية) بترتيب عشوائي ثابت
+    
+    الترتيب عشوائي كما تُضاف الكلمات فعلاً، فالكلمات المرتبة تجعل كل إضافة لقائمة مرتبة
+    في آخرها وتخفي تكلفة الإدخال في الوسط.
+    """
+    keywords = set()
+    while len(keywords) < count:
+        words = ["".join(rng.choice(ARABIC_LETTERS) for _ in range(rng.randint(3, 7)))
+                 for _ in range(rng.randint(1, 2))]
+        keywords.add(" ".join(words))
+    # الترتيب أولاً لأن ترتيب المجموعة يختلف بين التشغيلات
+    keywords = sorted(keywords)
+    rng.shuffle(keywords)
+    return keywords
+
+def populate(bot, keywords, owner, rng):
+    """تعبئة قاعدة البيانات بالنصوص وبعض الملصقات
+    
+    كل نص يُضاف بـ 1-3 كلمات كما في /st الحقيقي، لأن كل كلمة تحفظ قائمة كلمات نصها
+    والدفعات الكبيرة تجعل حجم البيانات ينمو تربيعياً.
+    """
+    db = bot.db
+    # الحفظ مرة واحدة في النهاية بدلاً من إعادة كتابة الملفات كل FLUSH_DIRTY_THRESHOLD نص
+    threshold, bot.FLUSH_DIRTY_THRESHOLD = bot.FLUSH_DIRTY_THRESHOLD, float("inf")
+    start = 0
+    while start < len(keywords):
+        size = rng.randint(1, 3)
+        db.add_text_response(keywords[start:start + size], f"رد تجريبي رقم {start}", owner)
+        start += size
+    bot.FLUSH_DIRTY_THRESHOLD = threshold
+    
+    stickers = max(len(keywords) // 10, 1)
+    for i in range(min(stickers, 1000)):
+        db.add_sticker_response(f"sticker{i}", [keywords[i % len(keywords)]], f"رد ملصق {i}", owner, f"usticker{i}")
+    db.save_all()
+    return min(stickers, 1000)
+
+def synthetic_updates(count, keywords, sticker_count, admin_ids, rng, admin_ratio=0.5, chats=200):
+    """خليط من النصوص والملصقات والأوامر من مشرفين ومستخدمين عاديين"""
+    chatter = make_keywords(200, rng)
+    commands = ["/start", "/stats", "/list", "/myinfo", "/help"]
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = 10_000 + rng.randrange(chats)
+        user_id = rng.choice(admin_ids) if rng.random() < admin_ratio else 50_000 + rng.randrange(5_000)
+        kind = rng.random()
+        if kind < 0.70:
+            # نصف الرسائل تحتوي كلمة محفوظة والباقي كلام عادي
+            words = rng.sample(chatter, 3)
+            if rng.random() < 0.5:
+                words.insert(1, rng.choice(keywords))
+            updates.append(make_update(update_id, " ".join(words), chat_id, user_id))
+        elif kind < 0.90:
+            file_id = f"sticker{rng.randrange(sticker_count * 2)}"
+            updates.append(make_sticker(update_id, file_id, chat_id, user_id))
+        elif kind < 0.95:
+            updates.append(make_command(update_id, f"/search {rng.choice(keywords).split()[0]}", chat_id, user_id))
+        else:
+            updates.append(make_command(update_id, rng.choice(commands), chat_id, user_id))
+    return updates
+
+def load_updates(path):
+    """تحديثات مسجلة: سطر JSON لكل تحديث (كما تصل من getUpdates أو الـ webhook)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def io_written():
+    """البايتات المكتوبة على القرص من العملية حتى الآن
+    
+    write_bytes ناقص cancelled_write_bytes من /proc، وليس wchar الذي يحسب أيضاً
+    الكتابة للأنابيب والسجلات.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["write_bytes"]) - int(counters["cancelled_write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def make_stub_bot(token, calls):
+    """Bot لا يتصل بالشبكة: كل طلب يُسجل في calls ويُرد عليه برد Bot API مناسب"""
+    from telegram.ext import ExtBot
+
+    message_ids = iter(range(1, 10 ** 12))
+
+    class StubBot(ExtBot):
+        async def _do_post(self, endpoint, data, **kwargs):
+            calls[endpoint] += 1
+            if endpoint == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            if endpoint in ("sendMessage", "editMessageText"):
+                return {
+                    "message_id": next(message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+                    "text": data.get("text", "")
+                }
+            return True
+
+    return StubBot(token)
+
+async def replay(bot, updates, concurrency):
+    """تمرير التحديثات عبر معالج التحديثات الحقيقي وقياس زمن كل تحديث حتى انتهاء معالجته"""
+    from telegram import Update
+
+    calls = Counter()
+    app = bot.build_application(make_stub_bot(bot.TOKEN, calls))
+    latencies = []
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def handle(payload):
+        update = Update.de_json(payload, app.bot)
+        started = time.perf_counter()
+        try:
+            await app.update_processor.process_update(update, app.process_update(update))
+        finally:
+            latencies.append(time.perf_counter() - started)
+            in_flight.release()
+
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+
+        written = io_written()
+        started = time.perf_counter()
+        tasks = []
+        for payload in updates:
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(handle(payload)))
+        await asyncio.gather(*tasks)
+        # الردود المنتظرة في الطابور أو قيد الإرسال جزء من العمل
+        while bot.outbox._queues or bot.outbox._in_flight:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        await app.stop()
+        await bot.post_stop(app)
+    await bot.post_shutdown(app)
+    written_total = io_written()
+
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "disk_bytes_written": written_total - written if written is not None else None,
+        "outgoing": dict(calls),
+    }
+
+def run_single(args):
+    """قياس حجم واحد داخل هذه العملية (تُستدعى في عملية مستقلة لكل حجم)"""
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    os.makedirs("data", exist_ok=True)
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    sys.path.insert(0, REPO_DIR)
+
+    import bot
+
+    # حدود الإرسال وتأخير الرد تقيس تيليجرام وليس البوت
+    if not args.real_limits:
+        bot.RESPONSE_DELAY = 0
+        bot.OUTBOX_GLOBAL_RATE = bot.OUTBOX_PRIVATE_RATE = bot.OUTBOX_GROUP_RATE = 10 ** 9
+        bot.outbox = bot.OutboundScheduler()
+
+    rng = random.Random(args.seed)
+    keywords = make_keywords(args.keywords, rng)
+    owner = min(bot.SUPER_ADMIN_IDS)
+
+    started = time.perf_counter()
+    sticker_count = populate(bot, keywords, owner, rng)
+    populate_seconds = time.perf_counter() - started
+
+    # زمن تحميل القاعدة وبناء الفهارس كما عند التشغيل
+    bot.db.close()
+    started = time.perf_counter()
+    bot.db = bot.AdvancedDatabase()
+    load_seconds = time.perf_counter() - started
+
+    if args.updates_file:
+        updates = load_updates(args.updates_file)
+    else:
+        updates = synthetic_updates(args.updates, keywords, sticker_count, sorted(bot.ADMIN_IDS), rng)
+
+    result = asyncio.run(replay(bot, updates, args.concurrency))
+    latencies = sorted(result["latencies"])
+    return {
+        "keywords": args.keywords,
+        "updates": len(updates),
+        "source": os.path.basename(args.updates_file) if args.updates_file else "synthetic",
+        "populate_seconds": round(populate_seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "elapsed": round(result["elapsed"], 3),
+        "throughput": round(len(updates) / result["elapsed"], 1) if result["elapsed"] else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "disk_bytes_written": result["disk_bytes_written"],
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "outgoing": result["outgoing"],
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(result):
+    """آخر نتيجة محفوظة بنفس الحجم ونفس مصدر التحديثات"""
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            saved = json.loads(line)
+            if all(saved.get(key) == result[key] for key in ("keywords", "updates", "source")):
+                previous = saved
+    return previous
+
+def print_result(result, previous):
+    def change(key, better_higher=True):
+        if not previous or not previous.get(key) or result.get(key) is None:
+            return ""
+        delta = (result[key] - previous[key]) / previous[key] * 100
+        sign = "+" if delta >= 0 else ""
+        mark = "" if abs(delta) < 5 else (" ✅" if (delta > 0) == better_higher else " ⚠️")
+        return f" ({sign}{delta:.0f}%{mark})"
+
+    print(f"• {result['keywords']} كلمة | {result['updates']} تحديث ({result['source']})")
+    print(f"  الإنتاجية: {result['throughput']} تحديث/ثانية{change('throughput')}")
+    print(f"  p50: {result['p50_ms']}ms{change('p50_ms', False)} | p99: {result['p99_ms']}ms{change('p99_ms', False)}")
+    written = result['disk_bytes_written']
+    print(f"  الكتابة على القرص: {written // 1024 if written is not None else '?'} KB{change('disk_bytes_written', False)}"
+          f" | أقصى ذاكرة: {result['peak_rss_kb'] // 1024} MB{change('peak_rss_kb', False)}")
+    print(f"  التعبئة: {result['populate_seconds']}s | التحميل: {result['load_seconds']}s{change('load_seconds', False)}")
+
+def run_replay(args):
+    """تشغيل كل حجم في عملية مستقلة وحفظ النتائج"""
+    sizes = [int(size) for size in args.keywords.split(",")]
+    results = []
+    for size in sizes:
+        command = [sys.executable, os.path.abspath(__file__), "replay", "--single", "--keywords", str(size),
+                   "--updates", str(args.updates), "--concurrency", str(args.concurrency), "--seed", str(args.seed)]
+        if args.updates_file:
+            command += ["--updates-file", os.path.abspath(args.updates_file)]
+        if args.real_limits:
+            command.append("--real-limits")
+
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"❌ فشل القياس بحجم {size}:\n{output.stderr[-2000:]}")
+            continue
+
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        result["revision"] = git_revision()
+        result["timestamp"] = datetime.now().isoformat(timespec="seconds")
+        print_result(result, previous_result(result))
+        results.append(result)
+
+    if results and not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"💾 حُفظت النتائج في {RESULTS_FILE}")
+
+def main():
+    parser = argparse.ArgumentParser(description="أدوات قياس أداء البوت")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    webhook = commands.add_parser("webhook", help="قياس خادم webhook يعمل")
+    webhook.add_argument("url")
+    webhook.add_argument("count", nargs="?", type=int, default=200)
+
+    replay_parser = commands.add_parser("replay", help="إعادة تشغيل تحديثات على التطبيق بدون اتصال")
+    replay_parser.add_argument("--keywords", default="10,1000,10000,100000", help="أحجام قاعدة الكلمات مفصولة بفواصل")
+    replay_parser.add_argument("--updates", type=int, default=5000, help="عدد التحديثات التركيبية")
+    replay_parser.add_argument("--updates-file", help="ملف تحديثات مسجلة (سطر JSON لكل تحديث)")
+    replay_parser.add_argument("--concurrency", type=int, default=64, help="أقصى عدد تحديثات قيد المعالجة")
+    replay_parser.add_argument("--seed", type=int, default=1)
+    replay_parser.add_argument("--real-limits", action="store_true", help="تطبيق حدود الإرسال وتأخير الرد الحقيقية")
+    replay_parser.add_argument("--no-save", action="store_true", help="عدم حفظ النتائج")
+    replay_parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.command == "webhook":
+        asyncio.run(webhook_probe(args.url, args.count))
+    elif args.single:
+        args.keywords = int(args.keywords)
+        print(json.dumps(run_single(args), ensure_ascii=False))
+    else:
+        run_replay(args)
+
+if __name__ == "__main__":
+    main()
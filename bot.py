@@ -1,17 +1,47 @@
+import gzip
+import hashlib
+import hmac
+import io
 import json
 import os
 import logging
 import asyncio
+import bisect
+import heapq
 import re
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import signal
+import sqlite3
+import tarfile
+import tempfile
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import AsyncExitStack, contextmanager
+from datetime import date, datetime, timedelta
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from telegram.error import BadRequest, RetryAfter
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application, 
+    ApplicationHandlerStop,
+    BaseUpdateProcessor,
     CommandHandler, 
     MessageHandler, 
     filters, 
     ContextTypes,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    InlineQueryHandler,
+    PersistenceInput,
+    PicklePersistence,
+    TypeHandler
 )
 
 # ========== استيراد الإعدادات ==========
@@ -38,18 +68,647 @@ if not TOKEN:
     print("3. أضف التوكن الجديد من @BotFather")
     exit(1)
 
-# ========== قاعدة البيانات المتقدمة ==========
-class AdvancedDatabase:
+# ========== توحيد النص العربي ==========
+# التشكيل والتطويل تُحذف، وأشكال الهمزة والتاء المربوطة والألف المقصورة تُوحد
+_ARABIC_NORMALIZATION = str.maketrans({
+    **{chr(c): None for c in range(0x064B, 0x0653)},
+    "\u0670": None,
+    "\u0640": None,
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي"
+})
+WORD_PATTERN = re.compile(r'[\w\u0600-\u06FF]+')
+
+def normalize_text(text):
+    """توحيد النص للمقارنة: أحرف صغيرة، بدون تشكيل، وهمزات وتاء مربوطة موحدة"""
+    return " ".join(text.lower().translate(_ARABIC_NORMALIZATION).split())
+
+# ========== مطابقة الكلمات المفتاحية ==========
+class KeywordMatcher:
+    """مطابقة كل الكلمات المفتاحية في مرور واحد على الرسالة (Aho–Corasick)
+    
+    عند وجود أكثر من تطابق تفوز الكلمة الأطول، ثم الأسبق في الرسالة.
+    """
+    
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        # أطول كلمة تنتهي عند كل عقدة (بما فيها روابط الفشل)
+        self._best = [None]
+        
+        for keyword in keywords:
+            if not keyword:
+                continue
+            node = 0
+            for ch in keyword:
+                child = self._goto[node].get(ch)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][ch] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                node = child
+            self._best[node] = keyword
+        
+        # بناء روابط الفشل بالعرض حتى تُحسب العقد الأقصر أولاً
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                if self._best[child] is None:
+                    self._best[child] = self._best[self._fail[child]]
+                queue.append(child)
+    
+    def find(self, text):
+        """إرجاع أطول كلمة مفتاحية موجودة في النص أو None"""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        node = 0
+        best = None
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            keyword = best_at[node]
+            # المقارنة الصارمة تبقي التطابق الأسبق عند تساوي الطول
+            if keyword is not None and (best is None or len(keyword) > len(best)):
+                best = keyword
+        return best
+
+# ========== البحث التقريبي ==========
+def bounded_levenshtein(a, b, max_distance):
+    """مسافة التحرير بين نصين، أو None إذا تجاوزت الحد المسموح"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    
+    previous = list(range(len(a) + 1))
+    for i, cb in enumerate(b, 1):
+        current = [i]
+        for j, ca in enumerate(a, 1):
+            current.append(min(previous[j - 1] + (ca != cb), current[j - 1] + 1, previous[j] + 1))
+        # التوقف مبكراً إذا تجاوز كل الصف الحد
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+class FuzzyIndex:
+    """فهرس ثلاثيات الأحرف لاختيار المرشحين قبل حساب مسافة التحرير"""
+    
+    # الثلاثيات الشائعة جداً (مثل " ال") لا تميز بين الكلمات
+    MAX_POSTING = 2000
+    
+    def __init__(self):
+        self._postings = defaultdict(set)
+    
+    @staticmethod
+    def _trigrams(text):
+        padded = f" {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def add(self, keyword):
+        for gram in self._trigrams(keyword):
+            self._postings[gram].add(keyword)
+    
+    def remove(self, keyword):
+        for gram in self._trigrams(keyword):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(keyword)
+                if not posting:
+                    del self._postings[gram]
+    
+    def find(self, queries, threshold, max_candidates):
+        """إرجاع الكلمة الأقرب لأي من النصوص إذا تجاوز تشابهها الحد، أو None"""
+        best, best_score = None, threshold
+        for query in queries:
+            counts = Counter()
+            for gram in self._trigrams(query):
+                posting = self._postings.get(gram)
+                if posting and len(posting) <= self.MAX_POSTING:
+                    counts.update(posting)
+            
+            # مسافة التحرير للمرشحين الأكثر اشتراكاً في الثلاثيات فقط
+            for keyword, _ in counts.most_common(max_candidates):
+                longest = max(len(keyword), len(query))
+                max_distance = int(longest * (1 - threshold) + 1e-9)
+                distance = bounded_levenshtein(query, keyword, max_distance)
+                if distance is None:
+                    continue
+                score = 1 - distance / longest
+                if score > best_score or (best is None and score >= threshold):
+                    best, best_score = keyword, score
+        return best
+
+# ========== فهرس البحث ==========
+class SearchIndex:
+    """فهرس مقلوب: كل كلمة موحدة ← العناصر التي تحتويها مع وزنها
+    
+    كلمات المفتاح أثقل وزناً من كلمات نص الرد. الكلمة غير الموجودة تُوسع لكلمات
+    المفردات التي تبدأ بها (بحث ثنائي في قائمة مرتبة)، فالاستعلام لا يمر على كل العناصر.
+    """
+    
+    KEYWORD_WEIGHT = 3
+    RESPONSE_WEIGHT = 1
+    MAX_PREFIX_EXPANSION = 20
+    
+    def __init__(self):
+        self._postings = {}
+        self._item_tokens = {}
+        self._vocabulary = []
+    
+    @staticmethod
+    def tokenize(text):
+        return WORD_PATTERN.findall(normalize_text(text))
+    
+    def _weights(self, keywords, response):
+        weights = Counter()
+        for token in self.tokenize(response):
+            weights[token] = self.RESPONSE_WEIGHT
+        for keyword in keywords:
+            for token in self.tokenize(keyword):
+                weights[token] = self.KEYWORD_WEIGHT
+        return weights
+    
+    def build(self, items):
+        """فهرسة كل العناصر [(المفتاح، الكلمات، الرد)] دفعة واحدة مع ترتيب المفردات مرة واحدة"""
+        self._postings = {}
+        self._item_tokens = {}
+        for item_key, keywords, response in items:
+            weights = self._item_tokens[item_key] = self._weights(keywords, response)
+            for token, weight in weights.items():
+                self._postings.setdefault(token, {})[item_key] = weight
+        self._vocabulary = sorted(self._postings)
+    
+    def add(self, item_key, keywords, response):
+        """فهرسة عنصر (يستبدل فهرسته السابقة إن وجدت)"""
+        self.remove(item_key)
+        weights = self._item_tokens[item_key] = self._weights(keywords, response)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocabulary, token)
+            postings[item_key] = weight
+    
+    def remove(self, item_key):
+        for token in self._item_tokens.pop(item_key, ()):
+            postings = self._postings[token]
+            del postings[item_key]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+    
+    def _expand(self, token):
+        """الكلمات المطابقة: الكلمة نفسها، أو الكلمات التي تبدأ بها"""
+        if token in self._postings:
+            return [(token, 1.0)]
+        start = bisect.bisect_left(self._vocabulary, token)
+        matches = []
+        for candidate in self._vocabulary[start:start + self.MAX_PREFIX_EXPANSION]:
+            if not candidate.startswith(token):
+                break
+            matches.append((candidate, 0.5))
+        return matches
+    
+    def search(self, query, limit, tiebreak=None):
+        """أفضل limit عنصر: الأكثر تغطية لكلمات الاستعلام ثم الأعلى وزناً"""
+        covered = Counter()
+        scores = Counter()
+        for token in set(self.tokenize(query)):
+            seen = set()
+            for match, factor in self._expand(token):
+                for item_key, weight in self._postings[match].items():
+                    scores[item_key] += weight * factor
+                    if item_key not in seen:
+                        seen.add(item_key)
+                        covered[item_key] += 1
+        
+        def rank(item_key):
+            return covered[item_key], scores[item_key], tiebreak(item_key) if tiebreak else 0
+        return heapq.nlargest(limit, scores, key=rank)
+
+class PrefixIndex:
+    """مصفوفة مرتبة من (كلمة موحدة، عنصر) للبحث بالبادئة ببحث ثنائي واحد
+    
+    تُفهرس الكلمة المفتاحية كاملة وكل كلمة داخلها، وكل كلمة تبدأ بـ "ال" تُفهرس أيضاً
+    بدونها، فـ "جدول" و "الامت" و "امتح" كلها تطابق "جدول الامتحانات".
+    """
+    
+    ARTICLE = "ال"
+    
+    def __init__(self):
+        self._entries = []
+        self._item_terms = {}
+    
+    def _terms(self, keywords):
+        terms = set()
+        for keyword in keywords:
+            normalized = normalize_text(keyword)
+            if not normalized:
+                continue
+            terms.add(normalized)
+            for word in WORD_PATTERN.findall(normalized):
+                terms.add(word)
+                # "ال" التعريف: تبقى كلمة من حرفين على الأقل بعد حذفها
+                if word.startswith(self.ARTICLE) and len(word) >= len(self.ARTICLE) + 2:
+                    terms.add(word[len(self.ARTICLE):])
+        return terms
+    
+    def build(self, items):
+        """فهرسة كل العناصر [(المفتاح، الكلمات)] دفعة واحدة مع ترتيب واحد"""
+        self._item_terms = {item_key: self._terms(keywords) for item_key, keywords in items}
+        self._entries = sorted(
+            (term, item_key) for item_key, terms in self._item_terms.items() for term in terms
+        )
+    
+    def add(self, item_key, keywords):
+        self.remove(item_key)
+        terms = self._item_terms[item_key] = self._terms(keywords)
+        for term in terms:
+            bisect.insort(self._entries, (term, item_key))
+    
+    def remove(self, item_key):
+        for term in self._item_terms.pop(item_key, ()):
+            position = bisect.bisect_left(self._entries, (term, item_key))
+            if position < len(self._entries) and self._entries[position] == (term, item_key):
+                del self._entries[position]
+    
+    def find(self, prefix, limit):
+        """أول limit عنصر مختلف تبدأ إحدى كلماته بالبادئة (البادئة موحدة مسبقاً)"""
+        results = []
+        seen = set()
+        position = bisect.bisect_left(self._entries, (prefix,))
+        while position < len(self._entries) and len(results) < limit:
+            term, item_key = self._entries[position]
+            if not term.startswith(prefix):
+                break
+            if item_key not in seen:
+                seen.add(item_key)
+                results.append(item_key)
+            position += 1
+        return results
+
+# ========== ذاكرة المطابقة المؤقتة ==========
+class ResolutionCache:
+    """ذاكرة مؤقتة محدودة (LRU + مدة صلاحية) لنتيجة مطابقة الرسالة الموحدة
+    
+    تحفظ الكلمة المطابقة أو None، فالرسائل التي لا رد لها لا يُعاد البحث فيها أيضاً.
+    """
+    
+    MISSING = object()
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        """إرجاع النتيجة المحفوظة أو MISSING"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return self.MISSING
+    
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+# ========== تجميع الإحصائيات ==========
+class StatsAggregator:
+    """عدادات استخدام مضغوطة في الذاكرة تُدمج في قاعدة البيانات مع كل دفعة حفظ
+    
+    تسجيل الرد الواحد مجرد زيادة بضعة أعداد صحيحة، ولا يُحسب التاريخ إلا عند تغير اليوم.
+    """
+    
     def __init__(self):
-        # تحميل الملفات مع القيم الافتراضية
-        self.stickers = self._safe_load(STICKERS_FILE)
-        self.texts = self._safe_load(TEXTS_FILE)
-        self.users = self._safe_load(USERS_FILE)
-        self.stats = self._safe_load(STATS_FILE)
+        self._day = None
+        self._day_end = 0.0
+        self._reset()
+    
+    def _reset(self):
+        self.stickers = Counter()
+        self.texts = Counter()
+        self.users = Counter()
+        self.daily = Counter()
+        self.hours = Counter()
+        self.last_used = {}
+    
+    def _roll_day(self, now):
+        today = datetime.fromtimestamp(now)
+        self._day = today.strftime("%Y-%m-%d")
+        self._day_start = datetime.combine(today.date(), datetime.min.time()).timestamp()
+        self._day_end = datetime.combine(today.date() + timedelta(days=1), datetime.min.time()).timestamp()
+    
+    def record(self, kind, item_id, user_id):
+        """تسجيل رد واحد (kind: "stickers" أو "texts")"""
+        now = time.time()
+        if now >= self._day_end:
+            self._roll_day(now)
+        
+        (self.stickers if kind == "stickers" else self.texts)[item_id] += 1
+        self.last_used[kind, item_id] = now
+        self.users[user_id] += 1
+        self.daily[self._day, kind] += 1
+        self.hours[self._day, min(int(now - self._day_start) // 3600, 23)] += 1
+    
+    def pending(self):
+        return bool(self.daily)
+    
+    def drain(self):
+        """إرجاع العدادات المتراكمة بصيغة قابلة للتسجيل ثم تصفيرها"""
+        def items_payload(kind, counter):
+            return {
+                item_id: [count, datetime.fromtimestamp(self.last_used[kind, item_id]).isoformat()]
+                for item_id, count in counter.items()
+            }
         
-        # تهيئة الإحصائيات
-        self._initialize_stats()
+        daily = {}
+        for (day, kind), count in self.daily.items():
+            daily.setdefault(day, {"stickers": 0, "texts": 0})[kind] = count
+        hours = {}
+        for (day, hour), count in self.hours.items():
+            hours.setdefault(day, {})[str(hour)] = count
+        
+        payload = {
+            "stickers": items_payload("stickers", self.stickers),
+            "texts": items_payload("texts", self.texts),
+            "users": {str(user_id): count for user_id, count in self.users.items()},
+            "daily": daily,
+            "hours": hours
+        }
+        self._reset()
+        return payload
+
+# ========== السلاسل الزمنية للإحصائيات ==========
+class StatsTimeSeries:
+    """عدادات الردود اليومية في مصفوفات مفهرسة باليوم مع تجميع الأيام القديمة
+    
+    تعمل مباشرة على قاموس stats["timeseries"] فيُحفظ مع الإحصائيات كما هو:
+    origin تاريخ أول يوم، stickers و texts عداد لكل يوم، hours توزيع الردود على
+    ساعات آخر الأيام. الأيام الأقدم من مدة الاحتفاظ تُجمع في weekly و monthly.
+    """
+    
+    def __init__(self, state, retention_days, hourly_days, weekly_retention):
+        self.state = state
+        self.retention_days = max(retention_days, 1)
+        self.hourly_days = hourly_days
+        self.weekly_retention = weekly_retention
+        for key in ("stickers", "texts", "hours"):
+            state.setdefault(key, [])
+        state.setdefault("weekly", {})
+        state.setdefault("monthly", {})
+        self._origin = date.fromisoformat(state["origin"]).toordinal() if state.get("origin") else None
+    
+    def _index(self, ordinal):
+        return ordinal - self._origin
+    
+    def _advance(self, ordinal):
+        """توسيع المصفوفات حتى اليوم المحدد وتجميع ما خرج من مدة الاحتفاظ"""
+        state = self.state
+        if self._origin is None or ordinal - self._origin >= len(state["stickers"]) + self.retention_days:
+            # فجوة أطول من مدة الاحتفاظ: كل الأيام الحالية تُجمع
+            self._roll_up(len(state["stickers"]))
+            self._origin = ordinal
+            state["origin"] = date.fromordinal(ordinal).isoformat()
+        
+        missing = self._index(ordinal) + 1 - len(state["stickers"])
+        if missing > 0:
+            state["stickers"].extend([0] * missing)
+            state["texts"].extend([0] * missing)
+            state["hours"].extend([0] * 24 for _ in range(missing))
+        
+        del state["hours"][:max(len(state["hours"]) - self.hourly_days, 0)]
+        self._roll_up(len(state["stickers"]) - self.retention_days)
+    
+    def _roll_up(self, count):
+        """نقل أقدم count يوم إلى المجاميع الأسبوعية والشهرية"""
+        state = self.state
+        if count <= 0:
+            return
+        
+        for offset in range(count):
+            stickers, texts = state["stickers"][offset], state["texts"][offset]
+            if stickers or texts:
+                self._add_rollup(date.fromordinal(self._origin + offset), stickers, texts)
+        
+        del state["stickers"][:count]
+        del state["texts"][:count]
+        del state["hours"][:max(len(state["hours"]) - len(state["stickers"]), 0)]
+        self._origin += count
+        state["origin"] = date.fromordinal(self._origin).isoformat()
+        
+        # الأسابيع الأقدم من مدة الاحتفاظ تبقى في المجاميع الشهرية فقط
+        weekly = state["weekly"]
+        if len(weekly) > self.weekly_retention:
+            for week in sorted(weekly)[:len(weekly) - self.weekly_retention]:
+                del weekly[week]
+    
+    def _add_rollup(self, day, stickers, texts):
+        year, week, _ = day.isocalendar()
+        for bucket, key in ((self.state["weekly"], f"{year}-W{week:02d}"),
+                            (self.state["monthly"], f"{day.year}-{day.month:02d}")):
+            counts = bucket.setdefault(key, [0, 0])
+            counts[0] += stickers
+            counts[1] += texts
+    
+    def add(self, day, stickers, texts, hours=None):
+        """إضافة عدادات يوم (day بصيغة YYYY-MM-DD، hours: ساعة ← عدد)"""
+        ordinal = date.fromisoformat(day).toordinal()
+        if self._origin is not None and ordinal < self._origin:
+            # يوم خارج مدة الاحتفاظ (مثلاً من سجل قديم) يذهب للمجاميع مباشرة
+            self._add_rollup(date.fromordinal(ordinal), stickers, texts)
+            return
         
+        self._advance(ordinal)
+        index = self._index(ordinal)
+        self.state["stickers"][index] += stickers
+        self.state["texts"][index] += texts
+        
+        hour_index = index - (len(self.state["stickers"]) - len(self.state["hours"]))
+        if hours and hour_index >= 0:
+            row = self.state["hours"][hour_index]
+            for hour, count in hours.items():
+                row[int(hour)] += count
+    
+    def day(self, day):
+        """(ملصقات، نصوص) ليوم محدد ضمن مدة الاحتفاظ"""
+        if self._origin is None:
+            return 0, 0
+        index = self._index(date.fromisoformat(day).toordinal())
+        if 0 <= index < len(self.state["stickers"]):
+            return self.state["stickers"][index], self.state["texts"][index]
+        return 0, 0
+    
+    def last_days(self, days, today=None):
+        """مجموع (ملصقات، نصوص) لآخر days يوم حتى اليوم"""
+        if self._origin is None:
+            return 0, 0
+        today = today or date.today()
+        end = self._index(today.toordinal()) + 1
+        start = max(end - days, 0)
+        end = min(end, len(self.state["stickers"]))
+        if start >= end:
+            return 0, 0
+        return sum(self.state["stickers"][start:end]), sum(self.state["texts"][start:end])
+    
+    def hour_histogram(self):
+        """توزيع الردود على ساعات اليوم خلال آخر الأيام المحفوظة"""
+        return [sum(column) for column in zip(*self.state["hours"])] if self.state["hours"] else [0] * 24
+
+# ========== نشاط المستخدمين ==========
+class UserActivityTracker:
+    """تتبع نشاط المستخدمين في الذاكرة وحفظه على دفعات
+    
+    آخر ظهور يُحفظ كرقم (epoch) ولا يُكتب على القرص إلا كل interval ثانية،
+    والمستخدمون الجدد يُجمعون ويُسجلون دفعة واحدة مع الحفظ القادم.
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_seen = {}
+        self.new_users = {}
+        self._next_flush = time.monotonic() + interval
+    
+    def seen(self, user_key):
+        self.last_seen[user_key] = int(time.time())
+    
+    def add(self, user_key, user):
+        self.new_users[user_key] = user
+    
+    def drain(self, include_activity=False):
+        """إرجاع المستخدمين الجدد، وأوقات النشاط إذا حان موعد حفظها"""
+        new_users, self.new_users = self.new_users, {}
+        seen = {}
+        if include_activity or time.monotonic() >= self._next_flush:
+            seen = {
+                user_key: datetime.fromtimestamp(timestamp).isoformat()
+                for user_key, timestamp in self.last_seen.items()
+            }
+            self.last_seen = {}
+            self._next_flush = time.monotonic() + self.interval
+        return new_users, seen
+
+# ========== لوحة المتصدرين ==========
+class Leaderboard:
+    """ترتيب المستخدمين حسب الاستخدام في قائمة مرتبة تُحدَّث مع كل زيادة
+    
+    العناصر (-الاستخدام، المعرف رقمياً، مفتاح المستخدم) فأعلى استخدام أولاً، وعند التساوي
+    الأصغر معرفاً (9 قبل 10).
+    أفضل K مستخدمين مجرد قص للقائمة، وترتيب أي مستخدم بحث ثنائي.
+    """
+    
+    def __init__(self):
+        self._entries = []
+        self._scores = {}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def _entry(user_key, usage):
+        return (-usage, int(user_key), user_key)
+    
+    def add(self, user_key, usage):
+        """إضافة مستخدم جديد (لا يفعل شيئاً إذا كان موجوداً)"""
+        if user_key not in self._scores:
+            self._scores[user_key] = usage
+            bisect.insort(self._entries, self._entry(user_key, usage))
+    
+    def update(self, user_key, usage):
+        old = self._scores.get(user_key)
+        if old is None:
+            self.add(user_key, usage)
+            return
+        if old == usage:
+            return
+        del self._entries[bisect.bisect_left(self._entries, self._entry(user_key, old))]
+        bisect.insort(self._entries, self._entry(user_key, usage))
+        self._scores[user_key] = usage
+    
+    def top(self, count):
+        """معرفات أفضل count مستخدمين مرتبة"""
+        return [user_key for _, _, user_key in self._entries[:count]]
+    
+    def rank(self, user_key):
+        """ترتيب المستخدم (يبدأ من 1) أو None"""
+        usage = self._scores.get(user_key)
+        if usage is None:
+            return None
+        return bisect.bisect_left(self._entries, self._entry(user_key, usage)) + 1
+
+# ========== محركات التخزين ==========
+class JsonStorage:
+    """تخزين JSON: لقطات ذرية للملفات مع سجل تعديلات يُعاد تطبيقه عند التشغيل"""
+    
+    # المجموعات التي يعدلها كل نوع من التعديلات المسجلة
+    _OP_COLLECTIONS = {
+        "users": ("users", "stats"),
+        "sticker_add": ("stickers", "users", "stats"),
+        "text_add": ("texts", "users", "stats"),
+        "hits": ("users", "stats"),
+        "delete": ("stickers", "texts", "stats")
+    }
+    
+    def _mark_dirty(self, op, payload):
+        self._dirty.update(self._OP_COLLECTIONS[op])
+        if op == "hits":
+            # ملفات الملصقات والنصوص تُعاد كتابتها فقط إذا كان في الدفعة استخدام لها
+            self._dirty.update(name for name in ("stickers", "texts") if payload.get(name))
+    
+    def __init__(self):
+        self._files = {
+            "stickers": STICKERS_FILE,
+            "texts": TEXTS_FILE,
+            "users": USERS_FILE,
+            "stats": STATS_FILE
+        }
+        # المجموعات المعدلة بانتظار الكتابة
+        self._dirty = set()
+        self._journal = None
+    
+    def load(self):
+        """تحميل الملفات مع القيم الافتراضية"""
+        self._finish_pending_flush()
+        return tuple(self._safe_load(self._files[name]) for name in ("stickers", "texts", "users", "stats"))
+    
+    def files(self):
+        """الملفات التي تمثل قاعدة البيانات على القرص"""
+        return list(self._files.values())
+    
     def _safe_load(self, filename):
         """تحميل ملف JSON بشكل آمن"""
         try:
@@ -63,15 +722,711 @@ class AdvancedDatabase:
             logger.error(f"خطأ في تحميل {filename}: {e}")
             return {}
     
-    def _save_file(self, data, filename):
-        """حفظ البيانات في ملف"""
+    def _write_temp(self, data, filename):
+        """كتابة البيانات في ملف مؤقت ومزامنته مع القرص"""
+        tmp_file = f"{filename}.tmp"
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
-            return True
+                f.flush()
+                os.fsync(f.fileno())
+            return tmp_file
         except Exception as e:
             logger.error(f"خطأ في حفظ {filename}: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return None
+    
+    def _sync_dir(self, filename):
+        """مزامنة المجلد لضمان ثبات إعادة التسمية"""
+        try:
+            fd = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+    
+    def touch(self, *collections):
+        """تعليم مجموعات عُدلت خارج السجل لحفظها في الدفعة القادمة"""
+        self._dirty.update(collections)
+    
+    def record(self, op, payload):
+        """إضافة سطر واحد لنهاية السجل"""
+        self._mark_dirty(op, payload)
+        try:
+            if self._journal is None:
+                os.makedirs(os.path.dirname(JOURNAL_FILE) or ".", exist_ok=True)
+                self._journal = open(JOURNAL_FILE, 'a', encoding='utf-8')
+            self._journal.write(json.dumps({"op": op, **payload}, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(self._journal.fileno())
+        except Exception as e:
+            logger.error(f"خطأ في الكتابة للسجل: {e}")
+    
+    def replay(self, apply):
+        """إعادة تطبيق التعديلات المسجلة بعد آخر حفظ"""
+        if not os.path.exists(JOURNAL_FILE):
+            return 0
+        
+        replayed = 0
+        with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    op = record.pop("op")
+                    apply(op, record)
+                except Exception as e:
+                    # السطر الأخير قد يكون ناقصاً بسبب انقطاع مفاجئ
+                    logger.warning(f"تجاهل سطر تالف في السجل: {e}")
+                    continue
+                self._mark_dirty(op, record)
+                replayed += 1
+        return replayed
+    
+    def flush(self, db, full=False):
+        """حفظ الملفات المعدلة فقط ثم تفريغ السجل"""
+        if full:
+            self._dirty.update(self._files)
+        if not self._dirty:
+            return False
+        
+        # كتابة كل الملفات المؤقتة أولاً حتى لا يُحفظ جزء دون الآخر
+        written = {}
+        for name in self._dirty:
+            tmp_file = self._write_temp(getattr(db, name), self._files[name])
+            if tmp_file is None:
+                for tmp in written.values():
+                    os.remove(tmp)
+                return False
+            written[name] = tmp_file
+        
+        # علامة الاعتماد تجعل استبدال الملفات ذرياً: بعد كتابتها يصبح السجل
+        # جزءاً من اللقطة، وعند انقطاع مفاجئ يُكمل التحميل التالي الاستبدال
+        # ويحذف السجل بدلاً من إعادة تطبيقه فوق لقطة تحتويه
+        marker = self._write_temp(sorted(written), FLUSH_COMMIT_FILE)
+        if marker is None:
+            for tmp in written.values():
+                os.remove(tmp)
             return False
+        os.replace(marker, FLUSH_COMMIT_FILE)
+        self._sync_dir(FLUSH_COMMIT_FILE)
+        
+        self._replace_snapshots(written)
+        self._dirty.clear()
+        self._truncate_journal()
+        os.remove(FLUSH_COMMIT_FILE)
+        return True
+    
+    def _replace_snapshots(self, written):
+        for name, tmp_file in written.items():
+            if os.path.exists(tmp_file):
+                os.replace(tmp_file, self._files[name])
+        self._sync_dir(STATS_FILE)
+    
+    def _finish_pending_flush(self):
+        """إكمال دفعة حفظ انقطعت بعد اعتمادها"""
+        if not os.path.exists(FLUSH_COMMIT_FILE):
+            return
+        try:
+            with open(FLUSH_COMMIT_FILE, 'r', encoding='utf-8') as f:
+                names = json.load(f)
+        except Exception as e:
+            logger.error(f"خطأ في قراءة علامة الحفظ: {e}")
+            return
+        
+        self._replace_snapshots({name: f"{self._files[name]}.tmp" for name in names})
+        self._truncate_journal()
+        os.remove(FLUSH_COMMIT_FILE)
+        logger.info("تم إكمال دفعة حفظ منقطعة")
+    
+    def _truncate_journal(self):
+        """حذف السجل بعد حفظ محتواه في الملفات"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        try:
+            if os.path.exists(JOURNAL_FILE):
+                os.remove(JOURNAL_FILE)
+        except Exception as e:
+            logger.error(f"خطأ في تفريغ السجل: {e}")
+    
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+class SQLiteStorage:
+    """تخزين SQLite بوضع WAL: كل عداد استخدام هو تحديث لصف واحد"""
+    
+    SCHEMA_VERSION = 1
+    USER_COLUMNS = ("id", "username", "first_name", "joined_date", "usage_count", "stickers_saved",
+                    "texts_saved", "last_active", "is_admin", "is_blocked", "language")
+    STICKER_COLUMNS = ("id", "file_id", "file_unique_id", "keywords", "response", "created_by", "created_at",
+                       "usage", "last_used")
+    TEXT_COLUMNS = ("keyword", "display_keyword", "response", "keywords", "created_by", "created_at", "usage", "last_used")
+    
+    def __init__(self, filename):
+        self.filename = filename
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._stats_touched = False
+        self._create_tables()
+    
+    def _create_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                joined_date TEXT,
+                usage_count INTEGER NOT NULL DEFAULT 0,
+                stickers_saved INTEGER NOT NULL DEFAULT 0,
+                texts_saved INTEGER NOT NULL DEFAULT 0,
+                last_active TEXT,
+                is_admin INTEGER NOT NULL DEFAULT 0,
+                is_blocked INTEGER NOT NULL DEFAULT 0,
+                language TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_users_usage ON users (usage_count);
+            CREATE TABLE IF NOT EXISTS stickers (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                keywords TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_by INTEGER,
+                created_at TEXT,
+                usage INTEGER NOT NULL DEFAULT 0,
+                last_used TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_stickers_file_id ON stickers (file_id);
+            CREATE TABLE IF NOT EXISTS texts (
+                keyword TEXT PRIMARY KEY,
+                display_keyword TEXT NOT NULL,
+                response TEXT NOT NULL,
+                keywords TEXT NOT NULL,
+                created_by INTEGER,
+                created_at TEXT,
+                usage INTEGER NOT NULL DEFAULT 0,
+                last_used TEXT
+            );
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT PRIMARY KEY,
+                stickers INTEGER NOT NULL DEFAULT 0,
+                texts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value
+            );
+        """)
+        
+        # إضافة الأعمدة الجديدة لقواعد البيانات القديمة
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(stickers)")}
+        if "file_unique_id" not in columns:
+            self.conn.execute("ALTER TABLE stickers ADD COLUMN file_unique_id TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_stickers_unique_id ON stickers (file_unique_id)")
+    
+    def files(self):
+        """الملفات التي تمثل قاعدة البيانات على القرص"""
+        self.conn.commit()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return [self.filename]
+    
+    # ========== التحويل بين الصفوف والقواميس ==========
+    def _user_row(self, user):
+        return (user["id"], user.get("username"), user.get("first_name"), user.get("joined_date"),
+                user.get("usage_count", 0), user.get("stickers_saved", 0), user.get("texts_saved", 0),
+                user.get("last_active"), int(bool(user.get("is_admin"))), int(bool(user.get("is_blocked"))),
+                user.get("language"))
+    
+    def _sticker_row(self, sticker_id, data):
+        return (sticker_id, data["file_id"], data.get("file_unique_id"),
+                json.dumps(data.get("keywords", []), ensure_ascii=False),
+                data["response"], data.get("created_by"), data.get("created_at"),
+                data.get("usage", 0), data.get("last_used"))
+    
+    def _text_row(self, keyword, data):
+        return (keyword, data.get("keyword", keyword), data["response"],
+                json.dumps(data.get("keywords", []), ensure_ascii=False), data.get("created_by"),
+                data.get("created_at"), data.get("usage", 0), data.get("last_used"))
+    
+    def _insert(self, table, columns, rows):
+        placeholders = ", ".join("?" * len(columns))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+        )
+    
+    def load(self):
+        """تحميل كل الجداول إلى الذاكرة"""
+        if self._get_meta("schema_version") is None:
+            self._migrate_from_json()
+        
+        users = {}
+        for row in self.conn.execute("SELECT * FROM users"):
+            user = dict(row)
+            user["is_admin"] = bool(user["is_admin"])
+            user["is_blocked"] = bool(user["is_blocked"])
+            users[str(user["id"])] = user
+        
+        stickers = {}
+        for row in self.conn.execute("SELECT * FROM stickers"):
+            data = dict(row)
+            data["keywords"] = json.loads(data["keywords"])
+            stickers[data.pop("id")] = data
+        
+        texts = {}
+        for row in self.conn.execute("SELECT * FROM texts"):
+            data = dict(row)
+            data["keywords"] = json.loads(data["keywords"])
+            data["keyword"] = data.pop("display_keyword")
+            texts[row["keyword"]] = data
+        
+        stats = {row["key"]: row["value"] for row in self.conn.execute("SELECT key, value FROM meta")}
+        stats.pop("schema_version", None)
+        if stats.get("timeseries"):
+            stats["timeseries"] = json.loads(stats["timeseries"])
+        else:
+            # جدول الأيام القديم يُحول مرة واحدة ويُفرغ مع أول حفظ
+            stats["daily_stats"] = {
+                row["day"]: {"stickers": row["stickers"], "texts": row["texts"]}
+                for row in self.conn.execute("SELECT * FROM daily_stats")
+            }
+        return stickers, texts, users, stats
+    
+    def _migrate_from_json(self):
+        """نقل البيانات من ملفات JSON القديمة (مرة واحدة عند أول تشغيل)"""
+        json_storage = JsonStorage()
+        if any(os.path.exists(f) for f in json_storage.files()):
+            legacy = AdvancedDatabase(json_storage)
+            legacy.close()
+            
+            self._insert("users", self.USER_COLUMNS,
+                         [self._user_row(u) for u in legacy.users.values() if isinstance(u, dict)])
+            self._insert("stickers", self.STICKER_COLUMNS,
+                         [self._sticker_row(sid, d) for sid, d in legacy.stickers.items()])
+            self._insert("texts", self.TEXT_COLUMNS,
+                         [self._text_row(kw, d) for kw, d in legacy.texts.items()])
+            self._write_stats(legacy.stats)
+            logger.info(
+                f"تم نقل {len(legacy.users)} مستخدم و{len(legacy.stickers)} ملصق "
+                f"و{len(legacy.texts)} نص من JSON إلى SQLite"
+            )
+        
+        self._set_meta("schema_version", self.SCHEMA_VERSION)
+        self.conn.commit()
+    
+    # ========== الإحصائيات العامة ==========
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+    
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    
+    def _increment_meta(self, amount, *keys):
+        for key in keys:
+            self.conn.execute("UPDATE meta SET value = value + ? WHERE key = ?", (amount, key))
+    
+    def _write_stats(self, stats):
+        # القيم البسيطة، والسلسلة الزمنية كقيمة JSON واحدة (مصفوفات صغيرة محدودة الطول)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(k, v) for k, v in stats.items() if isinstance(v, (int, float, str))]
+        )
+        if isinstance(stats.get("timeseries"), dict):
+            self._set_meta("timeseries", json.dumps(stats["timeseries"], separators=(",", ":")))
+            self.conn.execute("DELETE FROM daily_stats")
+    
+    # ========== التعديلات ==========
+    def touch(self, *collections):
+        """تعليم مجموعات عُدلت خارج السجل لحفظها في الدفعة القادمة"""
+        if "stats" in collections:
+            self._stats_touched = True
+    
+    def record(self, op, payload):
+        """تنفيذ التعديل كتحديث SQL داخل المعاملة الحالية"""
+        getattr(self, f"_record_{op}")(**payload)
+    
+    def replay(self, apply):
+        # SQLite يضمن ثبات المعاملات المؤكدة، لا يوجد سجل لإعادة تطبيقه
+        return 0
+    
+    def _record_users(self, new, seen):
+        cursor = self.conn.executemany(
+            f"INSERT OR IGNORE INTO users ({', '.join(self.USER_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(self.USER_COLUMNS))})",
+            [self._user_row(user) for user in new.values()]
+        )
+        if cursor.rowcount > 0:
+            self._increment_meta(cursor.rowcount, "total_users")
+        self.conn.executemany(
+            "UPDATE users SET last_active = ? WHERE id = ?",
+            [(last_active, int(user_key)) for user_key, last_active in seen.items()]
+        )
+    
+    def _record_sticker_add(self, sticker_id, data):
+        self._insert("stickers", self.STICKER_COLUMNS, [self._sticker_row(sticker_id, data)])
+        self.conn.execute("UPDATE users SET stickers_saved = stickers_saved + 1 WHERE id = ?", (data["created_by"],))
+        self._set_meta("total_stickers", self.conn.execute("SELECT COUNT(*) FROM stickers").fetchone()[0])
+    
+    def _record_text_add(self, entries, user_id):
+        self._insert("texts", self.TEXT_COLUMNS, [self._text_row(kw, d) for kw, d in entries.items()])
+        self.conn.execute("UPDATE users SET texts_saved = texts_saved + 1 WHERE id = ?", (user_id,))
+        self._set_meta("total_texts", self.conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0])
+    
+    def _record_hits(self, stickers, texts, users, daily, hours=None):
+        self.conn.executemany(
+            "UPDATE stickers SET usage = usage + ?, last_used = ? WHERE id = ?",
+            [(count, last_used, sticker_id) for sticker_id, (count, last_used) in stickers.items()]
+        )
+        self.conn.executemany(
+            "UPDATE texts SET usage = usage + ?, last_used = ? WHERE keyword = ?",
+            [(count, last_used, keyword) for keyword, (count, last_used) in texts.items()]
+        )
+        self.conn.executemany(
+            "UPDATE users SET usage_count = usage_count + ? WHERE id = ?",
+            [(count, int(user_id)) for user_id, count in users.items()]
+        )
+        # السلسلة الزمنية تُكتب من الذاكرة مع تأكيد المعاملة
+        self._stats_touched = True
+        sticker_total = sum(counts["stickers"] for counts in daily.values())
+        text_total = sum(counts["texts"] for counts in daily.values())
+        self._increment_meta(sticker_total, "sticker_responses")
+        self._increment_meta(text_total, "text_responses")
+        self._increment_meta(sticker_total + text_total, "total_responses")
+    
+    def _record_delete(self, item_type, item_id):
+        if item_type == "sticker":
+            self.conn.execute("DELETE FROM stickers WHERE id = ?", (item_id,))
+            self._set_meta("total_stickers", self.conn.execute("SELECT COUNT(*) FROM stickers").fetchone()[0])
+        elif item_type == "text":
+            self.conn.execute("DELETE FROM texts WHERE keyword = ?", (item_id,))
+            self._set_meta("total_texts", self.conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0])
+    
+    def flush(self, db, full=False):
+        """تأكيد المعاملة الحالية"""
+        if full or self._stats_touched:
+            self._write_stats(db.stats)
+            self._stats_touched = False
+        self.conn.commit()
+        return True
+    
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def create_storage():
+    """إنشاء محرك التخزين المحدد في الإعدادات"""
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_FILE)
+    return JsonStorage()
+
+# ========== النسخ الاحتياطي ==========
+class BackupEngine:
+    """نسخ احتياطية مضغوطة بعنوان المحتوى مع سياسة احتفاظ
+    
+    كل ملف يُخزن مرة واحدة مضغوطاً باسم بصمته (objects/ab/abcd....gz)، وكل نسخة
+    مجرد قائمة صغيرة بأسماء الملفات وبصماتها (snapshots/YYYYmmdd_HHMMSS.json).
+    الملفات غير المتغيرة لا تُكتب مرة أخرى. الدوال متزامنة وتُشغل في خيط منفصل.
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+    
+    # ========== القراءة والكتابة ==========
+    @staticmethod
+    def _read_source(path):
+        """قراءة ملف للنسخ، وقاعدة SQLite عبر نسخة متسقة بدلاً من الملف المفتوح"""
+        if path.endswith(".db"):
+            # اسم فريد لكل نسخة حتى لا يكتب التصدير و /backup المتزامنان في نفس الملف
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", suffix=".backup", delete=False) as f:
+                tmp_file = f.name
+            source = sqlite3.connect(path)
+            target = sqlite3.connect(tmp_file)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            try:
+                with open(tmp_file, 'rb') as f:
+                    return f.read()
+            finally:
+                os.remove(tmp_file)
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    @staticmethod
+    def _write_atomic(path, content):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, path)
+    
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.gz")
+    
+    def _manifest_path(self, name):
+        return os.path.join(self.snapshots_dir, f"{name}.json")
+    
+    # ========== إنشاء النسخ ==========
+    def create(self, paths):
+        """إنشاء نسخة من الملفات، أو None إذا لم يتغير شيء منذ آخر نسخة"""
+        files = {}
+        written = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            content = self._read_source(path)
+            digest = hashlib.sha256(content).hexdigest()
+            files[path] = {"sha256": digest, "size": len(content)}
+            
+            object_path = self._object_path(digest)
+            if not os.path.exists(object_path):
+                compressed = gzip.compress(content, mtime=0)
+                self._write_atomic(object_path, compressed)
+                written += len(compressed)
+        
+        latest = self.latest()
+        if latest and self.load_manifest(latest)["files"] == files:
+            return None
+        
+        now = datetime.now()
+        name = now.strftime("%Y%m%d_%H%M%S")
+        suffix = 1
+        while os.path.exists(self._manifest_path(name)):
+            name = f"{now.strftime('%Y%m%d_%H%M%S')}_{suffix}"
+            suffix += 1
+        manifest = {"created": now.isoformat(), "files": files}
+        self._write_atomic(self._manifest_path(name), json.dumps(manifest, ensure_ascii=False).encode())
+        return {"name": name, "files": len(files), "bytes_written": written}
+    
+    def snapshots(self):
+        """أسماء النسخ من الأقدم للأحدث"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.snapshots_dir) if name.endswith(".json"))
+    
+    def latest(self):
+        names = self.snapshots()
+        return names[-1] if names else None
+    
+    def load_manifest(self, name):
+        with open(self._manifest_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    # ========== الاستعادة ==========
+    def verify(self, name):
+        """فك ضغط كل ملفات النسخة ومطابقة بصماتها، وإرجاع المحتوى {المسار: البايتات}"""
+        contents = {}
+        for path, info in self.load_manifest(name)["files"].items():
+            with open(self._object_path(info["sha256"]), 'rb') as f:
+                content = gzip.decompress(f.read())
+            if hashlib.sha256(content).hexdigest() != info["sha256"] or len(content) != info["size"]:
+                raise ValueError(f"بصمة غير مطابقة للملف {path}")
+            contents[path] = content
+        return contents
+    
+    def restore(self, contents):
+        """كتابة محتوى تم التحقق منه فوق ملفات قاعدة البيانات"""
+        for path, content in contents.items():
+            if path.endswith(".db"):
+                # ملفات WAL القديمة لا تخص القاعدة المستعادة
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            self._write_atomic(path, content)
+    
+    # ========== الاحتفاظ ==========
+    def prune(self, keep_hourly, keep_daily, keep_weekly):
+        """حذف النسخ خارج سياسة الاحتفاظ ثم حذف الملفات غير المستخدمة"""
+        names = self.snapshots()
+        keep = set(names[-1:])
+        for count, bucket in ((keep_hourly, lambda t: t[:11]), (keep_daily, lambda t: t[:8]),
+                              (keep_weekly, lambda t: datetime.strptime(t[:8], "%Y%m%d").isocalendar()[:2])):
+            buckets = set()
+            # الأحدث في كل ساعة/يوم/أسبوع، لآخر count فترة
+            for name in reversed(names):
+                key = bucket(name)
+                if key not in buckets:
+                    if len(buckets) >= count:
+                        break
+                    buckets.add(key)
+                    keep.add(name)
+        
+        removed = [name for name in names if name not in keep]
+        for name in removed:
+            os.remove(self._manifest_path(name))
+        if removed:
+            self._collect_garbage()
+        return len(removed)
+    
+    def _collect_garbage(self):
+        referenced = set()
+        for name in self.snapshots():
+            referenced.update(info["sha256"] for info in self.load_manifest(name)["files"].values())
+        for folder, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                if filename.endswith(".gz") and filename[:-3] not in referenced:
+                    os.remove(os.path.join(folder, filename))
+
+# ========== التصدير إلى وجهة خارجية ==========
+class LocalDirectorySink:
+    """وجهة التصدير الافتراضية: مجلد محلي (يمكن حفظه بين التشغيلات عبر actions/cache)
+    
+    أي وجهة أخرى تحتاج نفس الدوال: names و writer و reader و delete.
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+    
+    def names(self):
+        """أسماء الأرشيفات من الأقدم للأحدث"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".tar.gz"))
+    
+    @contextmanager
+    def writer(self, name):
+        """ملف للكتابة لا يظهر باسمه النهائي إلا بعد اكتماله"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+    
+    def reader(self, name):
+        return open(os.path.join(self.directory, name), 'rb')
+    
+    def delete(self, name):
+        os.remove(os.path.join(self.directory, name))
+
+class StateExporter:
+    """تصدير كل قاعدة البيانات في أرشيف tar.gz واحد واستعادة آخر أرشيف
+    
+    الأرشيف يبدأ بـ manifest.json (بصمة كل ملف) ثم الملفات، ويُكتب ويُقرأ كتدفق
+    فلا يحتاج الوصول العشوائي للوجهة.
+    """
+    
+    MANIFEST = "manifest.json"
+    
+    def __init__(self, sink, keep):
+        self.sink = sink
+        self.keep = keep
+    
+    def export(self, paths):
+        """كتابة أرشيف جديد في الوجهة وحذف الأقدم من العدد المحفوظ"""
+        contents = {path: BackupEngine._read_source(path) for path in paths if os.path.exists(path)}
+        manifest = json.dumps(
+            {path: hashlib.sha256(content).hexdigest() for path, content in contents.items()}
+        ).encode()
+        
+        name = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tar.gz"
+        size = 0
+        with self.sink.writer(name) as f:
+            with tarfile.open(fileobj=f, mode="w|gz") as archive:
+                for member, content in ((self.MANIFEST, manifest), *contents.items()):
+                    info = tarfile.TarInfo(member)
+                    info.size = len(content)
+                    archive.addfile(info, io.BytesIO(content))
+                    size += len(content)
+        
+        for old in self.sink.names()[:-self.keep]:
+            self.sink.delete(old)
+        return {"name": name, "files": len(contents), "bytes": size}
+    
+    def load_latest(self):
+        """قراءة آخر أرشيف والتحقق من بصماته: (الاسم، {المسار: المحتوى}) أو None"""
+        names = self.sink.names()
+        if not names:
+            return None
+        
+        manifest = None
+        contents = {}
+        with self.sink.reader(names[-1]) as f, tarfile.open(fileobj=f, mode="r|gz") as archive:
+            for info in archive:
+                content = archive.extractfile(info).read()
+                if info.name == self.MANIFEST:
+                    manifest = json.loads(content)
+                else:
+                    contents[info.name] = content
+        
+        if manifest is None or set(manifest) != set(contents):
+            raise ValueError(f"أرشيف ناقص: {names[-1]}")
+        for path, content in contents.items():
+            # المسارات نسبية داخل مجلد البوت فقط
+            if os.path.isabs(path) or os.path.normpath(path).startswith(".."):
+                raise ValueError(f"مسار غير مسموح في الأرشيف: {path}")
+            if hashlib.sha256(content).hexdigest() != manifest[path]:
+                raise ValueError(f"بصمة غير مطابقة للملف {path}")
+        return names[-1], contents
+
+# ========== قاعدة البيانات المتقدمة ==========
+class AdvancedDatabase:
+    def __init__(self, storage=None):
+        # تحميل البيانات من محرك التخزين
+        self.storage = storage or create_storage()
+        self.stickers, self.texts, self.users, self.stats = self.storage.load()
+        self._pending_changes = 0
+        self.generation = 0
+        self.stats_aggregator = StatsAggregator()
+        self.activity = UserActivityTracker(USER_ACTIVITY_INTERVAL)
+        
+        # فهارس الملصقات: file_id / file_unique_id ← معرفات الملصقات بترتيب الإضافة
+        self._sticker_by_file_id = {}
+        self._sticker_by_unique_id = {}
+        self._next_sticker_number = 1
+        
+        # الفهرس المرتب للقائمة: الملصقات بأرقامها ثم النصوص أبجدياً
+        # نسخة الفهرس: معرف فريد لهذا التحميل مع عداد التغييرات، فلا تتطابق نسخة
+        # محفوظة في user_data قبل إعادة التشغيل أو الاستعادة مع فهرس مختلف
+        self._catalog = []
+        self.catalog_version = (uuid.uuid4().hex, 0)
+        
+        # فهرس البحث في الكلمات والردود لأمر /search، وفهرس البادئات لوضع الإنلاين
+        self.search_index = SearchIndex()
+        self.prefix_index = PrefixIndex()
+        for sticker_id, data in self.stickers.items():
+            self._index_sticker(sticker_id, data, loading=True)
+        
+        # مطابق الكلمات المفتاحية، يُبنى عند الحاجة بعد أي تغيير
+        self._matcher = None
+        self.resolution_cache = ResolutionCache(RESOLUTION_CACHE_SIZE, RESOLUTION_CACHE_TTL)
+        
+        # فهرس الكلمات الموحدة: الشكل الموحد ← مفاتيح النصوص بترتيب الإضافة
+        self._normalized_texts = {}
+        self._fuzzy_index = FuzzyIndex()
+        for keyword in self.texts:
+            self._index_text(keyword, loading=True)
+        self._build_item_indexes()
+        
+        # ترتيب المستخدمين حسب الاستخدام
+        self.leaderboard = Leaderboard()
+        for user_key, user in self.users.items():
+            if isinstance(user, dict):
+                self.leaderboard.add(user_key, user.get("usage_count", 0))
+        
+        # تهيئة الإحصائيات
+        self._initialize_stats()
+        
+        # استعادة التعديلات التي لم تدخل في آخر حفظ
+        replayed = self.storage.replay(self._apply)
+        if replayed:
+            logger.info(f"تمت استعادة {replayed} تعديل من السجل")
+            self.flush()
     
     def _initialize_stats(self):
         """تهيئة الإحصائيات المفقودة"""
@@ -84,7 +1439,7 @@ class AdvancedDatabase:
             "total_responses": 0,
             "sticker_responses": 0,
             "text_responses": 0,
-            "daily_stats": {},
+            "timeseries": {},
             "user_stats": {}
         }
         
@@ -93,102 +1448,306 @@ class AdvancedDatabase:
             if key not in self.stats:
                 self.stats[key] = value
         
+        self.timeseries = StatsTimeSeries(
+            self.stats["timeseries"], STATS_RETENTION_DAYS, STATS_HOURLY_DAYS, STATS_WEEKLY_RETENTION
+        )
+        # تحويل الإحصائيات اليومية القديمة (قاموس لكل يوم) إلى السلسلة الزمنية
+        legacy_daily = self.stats.pop("daily_stats", None) or {}
+        for day, counts in sorted(legacy_daily.items()):
+            self.timeseries.add(day, counts.get("stickers", 0), counts.get("texts", 0))
+        
         # حفظ الإحصائيات المحدثة
-        self._save_file(self.stats, STATS_FILE)
+        self.storage.touch("stats")
+    
+    def fold_users(self, include_activity=False):
+        """تسجيل المستخدمين الجدد وأوقات النشاط المتراكمة"""
+        new_users, seen = self.activity.drain(include_activity)
+        if new_users or seen:
+            self._commit("users", new=new_users, seen=seen)
+    
+    def fold_stats(self):
+        """دمج عدادات الاستخدام المتراكمة في البيانات"""
+        # المستخدمون الجدد يُسجلون قبل عداداتهم حتى تصح إعادة تطبيق السجل
+        self.fold_users()
+        if self.stats_aggregator.pending():
+            self._commit("hits", **self.stats_aggregator.drain())
+    
+    def flush(self):
+        """حفظ التعديلات المؤجلة"""
+        self.fold_stats()
+        self._pending_changes = 0
+        return self.storage.flush(self)
     
     def save_all(self):
         """حفظ جميع البيانات"""
-        self._save_file(self.stickers, STICKERS_FILE)
-        self._save_file(self.texts, TEXTS_FILE)
-        self._save_file(self.users, USERS_FILE)
-        self._save_file(self.stats, STATS_FILE)
-        return True
+        self._pending_changes = 0
+        return self.storage.flush(self, full=True)
+    
+    def close(self):
+        """حفظ التعديلات وإغلاق محرك التخزين"""
+        self.fold_users(include_activity=True)
+        self.flush()
+        self.storage.close()
+    
+    # ========== سجل التعديلات ==========
+    def _commit(self, op, **payload):
+        """تطبيق التعديل في الذاكرة وتسجيله في محرك التخزين"""
+        self._apply(op, payload)
+        self.storage.record(op, payload)
+        self._pending_changes += 1
+        self.generation += 1
+        
+        # الحفظ الفوري إذا كان الحفظ المؤجل معطلاً أو تجاوزنا الحد
+        if not WRITE_BEHIND or self._pending_changes >= FLUSH_DIRTY_THRESHOLD:
+            self.flush()
+    
+    def _apply(self, op, payload):
+        getattr(self, f"_apply_{op}")(**payload)
+    
+    def _apply_hits(self, stickers, texts, users, daily, hours=None):
+        for collection, hits in ((self.stickers, stickers), (self.texts, texts)):
+            for item_id, (count, last_used) in hits.items():
+                data = collection.get(item_id)
+                if data is not None:
+                    data["usage"] += count
+                    data["last_used"] = last_used
+        
+        for user_key, count in users.items():
+            user = self.users.get(user_key)
+            if user:
+                user["usage_count"] += count
+                self.leaderboard.update(user_key, user["usage_count"])
+        
+        hours = hours or {}
+        for day, counts in sorted(daily.items()):
+            self.timeseries.add(day, counts["stickers"], counts["texts"], hours.get(day))
+            self.stats["sticker_responses"] += counts["stickers"]
+            self.stats["text_responses"] += counts["texts"]
+            self.stats["total_responses"] += counts["stickers"] + counts["texts"]
+    
+    def _apply_users(self, new, seen):
+        for user_key, user in new.items():
+            user = self.users.setdefault(user_key, user)
+            self.leaderboard.add(user_key, user.get("usage_count", 0))
+        self.stats["total_users"] = len(self.users)
+        
+        for user_key, last_active in seen.items():
+            user = self.users.get(user_key)
+            if user:
+                user["last_active"] = last_active
+    
+    def _build_item_indexes(self):
+        """بناء القائمة وفهارس البحث لكل العناصر دفعة واحدة عند التحميل
+        
+        الإضافة عنصراً عنصراً في قوائم مرتبة تكلف O(n²) مع القواعد الكبيرة.
+        """
+        items = [("sticker", sticker_id) for sticker_id in self.stickers]
+        items.extend(("text", keyword) for keyword in self.texts)
+        
+        self._catalog = sorted(self._catalog_key(*item) for item in items)
+        fields = [(item, *self._search_fields(*item)) for item in items]
+        self.search_index.build(fields)
+        self.prefix_index.build((item, keywords) for item, keywords, _ in fields)
+    
+    def _search_fields(self, item_type, item_id):
+        """(الكلمات، الرد) التي يُبحث فيها عن العنصر"""
+        if item_type == "sticker":
+            data = self.stickers[item_id]
+            return data.get("keywords", []), data.get("response", "")
+        data = self.texts[item_id]
+        return [data.get("keyword", item_id)], data.get("response", "")
+    
+    def _index_item(self, item_type, item_id):
+        """إضافة عنصر واحد للقائمة وفهارس البحث"""
+        self._catalog_add(self._catalog_key(item_type, item_id))
+        keywords, response = self._search_fields(item_type, item_id)
+        self.search_index.add((item_type, item_id), keywords, response)
+        self.prefix_index.add((item_type, item_id), keywords)
+    
+    def _unindex_item(self, item_type, item_id):
+        self._catalog_remove(self._catalog_key(item_type, item_id))
+        self.search_index.remove((item_type, item_id))
+        self.prefix_index.remove((item_type, item_id))
+    
+    def _index_sticker(self, sticker_id, data, loading=False):
+        """إضافة الملصق لفهارس البحث (loading: القائمة وفهارس البحث تُبنى لاحقاً دفعة واحدة)"""
+        self._sticker_by_file_id.setdefault(data.get("file_id"), {})[sticker_id] = None
+        if data.get("file_unique_id"):
+            self._sticker_by_unique_id.setdefault(data["file_unique_id"], {})[sticker_id] = None
+        
+        # المعرف التالي أكبر من كل المعرفات الموجودة حتى لا يتكرر بعد الحذف
+        number = sticker_id.rpartition("_")[2]
+        if number.isdigit():
+            self._next_sticker_number = max(self._next_sticker_number, int(number) + 1)
+        if not loading:
+            self._index_item("sticker", sticker_id)
+    
+    def _unindex_sticker(self, sticker_id, data):
+        """حذف الملصق من فهارس البحث"""
+        # ملصق آخر محفوظ بنفس المعرف (إن وجد) يبقى في الفهرس ويحل محله
+        for index, key in ((self._sticker_by_file_id, data.get("file_id")),
+                           (self._sticker_by_unique_id, data.get("file_unique_id"))):
+            sticker_ids = index.get(key)
+            if sticker_ids is not None:
+                sticker_ids.pop(sticker_id, None)
+                if not sticker_ids:
+                    del index[key]
+        self._unindex_item("sticker", sticker_id)
+    
+    @staticmethod
+    def _catalog_key(item_type, item_id):
+        """مفتاح الترتيب في القائمة: (النوع، الرقم، المعرف)"""
+        if item_type == "sticker":
+            number = item_id.rpartition("_")[2]
+            return (0, int(number) if number.isdigit() else 0, item_id)
+        return (1, 0, item_id)
+    
+    def _bump_catalog_version(self):
+        instance, changes = self.catalog_version
+        self.catalog_version = (instance, changes + 1)
+    
+    def _catalog_add(self, key):
+        position = bisect.bisect_left(self._catalog, key)
+        if position == len(self._catalog) or self._catalog[position] != key:
+            self._catalog.insert(position, key)
+            self._bump_catalog_version()
+    
+    def _catalog_remove(self, key):
+        position = bisect.bisect_left(self._catalog, key)
+        if position < len(self._catalog) and self._catalog[position] == key:
+            del self._catalog[position]
+            self._bump_catalog_version()
+    
+    def _apply_sticker_add(self, sticker_id, data):
+        self.stickers[sticker_id] = data
+        self._index_sticker(sticker_id, data)
+        self.stats["total_stickers"] = len(self.stickers)
+        
+        user = self.users.get(str(data["created_by"]))
+        if user:
+            user["stickers_saved"] += 1
+    
+    def _index_text(self, keyword, loading=False):
+        """إضافة الكلمة لفهرس الكلمات الموحدة (loading كما في _index_sticker)"""
+        normalized = normalize_text(keyword)
+        keywords = self._normalized_texts.get(normalized)
+        if keywords is None:
+            self._normalized_texts[normalized] = [keyword]
+            self._fuzzy_index.add(normalized)
+        elif keyword not in keywords:
+            keywords.append(keyword)
+        if not loading:
+            self._index_item("text", keyword)
+        self._matcher = None
+        self.resolution_cache.clear()
+    
+    def _unindex_text(self, keyword):
+        """حذف الكلمة من فهرس الكلمات الموحدة"""
+        normalized = normalize_text(keyword)
+        keywords = self._normalized_texts.get(normalized)
+        if keywords is not None and keyword in keywords:
+            # كلمة أخرى لها نفس الشكل الموحد (إن وجدت) تحل محلها
+            keywords.remove(keyword)
+            if not keywords:
+                del self._normalized_texts[normalized]
+                self._fuzzy_index.remove(normalized)
+        self._unindex_item("text", keyword)
+        self._matcher = None
+        self.resolution_cache.clear()
+    
+    def _apply_text_add(self, entries, user_id):
+        self.texts.update(entries)
+        for keyword in entries:
+            self._index_text(keyword)
+        self.stats["total_texts"] = len(self.texts)
+        
+        user = self.users.get(str(user_id))
+        if user:
+            user["texts_saved"] += 1
+    
+    def _apply_delete(self, item_type, item_id):
+        if item_type == "sticker":
+            data = self.stickers.pop(item_id, None)
+            if data is not None:
+                self._unindex_sticker(item_id, data)
+            self.stats["total_stickers"] = len(self.stickers)
+        elif item_type == "text":
+            if self.texts.pop(item_id, None) is not None:
+                self._unindex_text(item_id)
+            self.stats["total_texts"] = len(self.texts)
     
     # ========== إدارة المستخدمين ==========
     def get_or_create_user(self, user_id, username="", first_name=""):
         """الحصول على بيانات المستخدم أو إنشائها"""
         user_key = str(user_id)
+        user = self.users.get(user_key)
         
-        if user_key not in self.users:
-            self.users[user_key] = {
+        if user is None:
+            now = datetime.now().isoformat()
+            user = {
                 "id": user_id,
                 "username": username,
                 "first_name": first_name,
-                "joined_date": datetime.now().isoformat(),
+                "joined_date": now,
                 "usage_count": 0,
                 "stickers_saved": 0,
                 "texts_saved": 0,
-                "last_active": datetime.now().isoformat(),
+                "last_active": now,
                 "is_admin": user_id in ADMIN_IDS,
                 "is_blocked": user_id in BLOCKED_USERS,
                 "language": BOT_LANGUAGE
             }
+            # يظهر فوراً في الذاكرة ويُسجل مع دفعة الحفظ القادمة
+            self.users[user_key] = user
             self.stats["total_users"] = len(self.users)
-            self.save_all()
+            self.leaderboard.add(user_key, 0)
+            self.activity.add(user_key, user)
         
         # تحديث وقت النشاط الأخير
-        self.users[user_key]["last_active"] = datetime.now().isoformat()
-        return self.users[user_key]
+        self.activity.seen(user_key)
+        return user
     
     # ========== إدارة الملصقات ==========
-    def add_sticker_response(self, file_id, keywords, response_text, user_id):
+    def add_sticker_response(self, file_id, keywords, response_text, user_id, file_unique_id=None):
         """إضافة رد نصي للملصق"""
-        sticker_id = f"sticker_{len(self.stickers) + 1}"
+        sticker_id = f"sticker_{self._next_sticker_number}"
         
-        self.stickers[sticker_id] = {
+        # التأكد من وجود المستخدم قبل تحديث إحصائياته
+        self.get_or_create_user(user_id)
+        self._commit("sticker_add", sticker_id=sticker_id, data={
             "file_id": file_id,
+            "file_unique_id": file_unique_id,
             "keywords": keywords,
             "response": response_text,
             "created_by": user_id,
             "created_at": datetime.now().isoformat(),
             "usage": 0,
             "last_used": None
-        }
-        
-        self.stats["total_stickers"] = len(self.stickers)
-        
-        # تحديث إحصائيات المستخدم
-        user = self.get_or_create_user(user_id)
-        user["stickers_saved"] += 1
-        
-        self.save_all()
+        })
         return sticker_id
     
-    def find_sticker_response(self, file_id, user_id):
+    def find_sticker_response(self, file_id, user_id, file_unique_id=None):
         """البحث عن رد نصي للملصق"""
-        for sticker_id, data in self.stickers.items():
-            if data.get("file_id") == file_id:
-                # تحديث الإحصائيات
-                data["usage"] += 1
-                data["last_used"] = datetime.now().isoformat()
-                
-                self.stats["sticker_responses"] += 1
-                self.stats["total_responses"] += 1
-                
-                # تحديث الإحصائيات اليومية
-                today = datetime.now().strftime("%Y-%m-%d")
-                if "daily_stats" not in self.stats:
-                    self.stats["daily_stats"] = {}
-                if today not in self.stats["daily_stats"]:
-                    self.stats["daily_stats"][today] = {"stickers": 0, "texts": 0}
-                self.stats["daily_stats"][today]["stickers"] += 1
-                
-                # تحديث إحصائيات المستخدم
-                user = self.get_or_create_user(user_id)
-                user["usage_count"] += 1
-                
-                self.save_all()
-                return data["response"]
-        
-        return None
+        # file_unique_id ثابت بين البوتات وإعادة الرفع لذلك له الأولوية
+        # عند تكرار الحفظ يُستخدم أحدث ملصق
+        sticker_ids = self._sticker_by_unique_id.get(file_unique_id) if file_unique_id else None
+        if not sticker_ids:
+            sticker_ids = self._sticker_by_file_id.get(file_id)
+        if not sticker_ids:
+            return None
+        sticker_id = next(reversed(sticker_ids))
+        
+        self._count_hit("stickers", sticker_id, user_id)
+        return self.stickers[sticker_id]["response"]
     
     # ========== إدارة النصوص ==========
     def add_text_response(self, keywords, response_text, user_id):
         """إضافة رد نصي للكلمات"""
+        entries = {}
         for keyword in keywords:
             keyword_lower = keyword.strip().lower()
             if keyword_lower and keyword_lower not in self.texts:
-                self.texts[keyword_lower] = {
+                entries[keyword_lower] = {
                     "keyword": keyword.strip(),
                     "response": response_text,
                     "keywords": keywords,
@@ -198,62 +1757,70 @@ class AdvancedDatabase:
                     "last_used": None
                 }
         
-        self.stats["total_texts"] = len(self.texts)
-        
-        # تحديث إحصائيات المستخدم
-        user = self.get_or_create_user(user_id)
-        user["texts_saved"] += 1
-        
-        self.save_all()
+        self.get_or_create_user(user_id)
+        self._commit("text_add", entries=entries, user_id=user_id)
         return True
     
     def find_text_response(self, message, user_id):
         """البحث عن رد نصي للكلمات"""
-        msg_lower = message.strip().lower()
+        msg_normalized = normalize_text(message)
+        
+        keyword = self.resolution_cache.get(msg_normalized)
+        if keyword is ResolutionCache.MISSING:
+            keyword = self._resolve_keyword(msg_normalized)
+            self.resolution_cache.put(msg_normalized, keyword)
         
+        if keyword is None:
+            return None
+        return self._get_text_response(keyword, user_id)
+    
+    def _resolve_keyword(self, msg_normalized):
+        """إيجاد مفتاح النص المطابق لرسالة موحدة، أو None"""
         # البحث المباشر
-        if msg_lower in self.texts:
-            return self._get_text_response(msg_lower, user_id)
+        keywords = self._normalized_texts.get(msg_normalized)
+        if keywords:
+            return keywords[0]
         
         # البحث في الكلمات
-        words = re.findall(r'[\w\u0600-\u06FF]+', msg_lower)
+        words = WORD_PATTERN.findall(msg_normalized)
         for word in words:
-            if word in self.texts:
-                return self._get_text_response(word, user_id)
+            keywords = self._normalized_texts.get(word)
+            if keywords:
+                return keywords[0]
         
         # البحث التقريبي إذا مفعل
         if FUZZY_SEARCH:
-            for keyword in self.texts.keys():
-                if keyword in msg_lower:
-                    return self._get_text_response(keyword, user_id)
+            normalized = self._text_matcher().find(msg_normalized)
+            if normalized is not None:
+                return self._normalized_texts[normalized][0]
+        
+        # البحث مع الأخطاء الإملائية: الرسالة القصيرة كاملة ثم كل كلمة
+        if APPROXIMATE_SEARCH:
+            queries = [msg_normalized] if len(words) <= 4 else []
+            queries.extend(word for word in words if len(word) >= 3)
+            normalized = self._fuzzy_index.find(queries, FUZZY_THRESHOLD, FUZZY_MAX_CANDIDATES)
+            if normalized is not None:
+                return self._normalized_texts[normalized][0]
         
         return None
     
+    def _text_matcher(self):
+        """مطابق الكلمات الحالي (يُعاد بناؤه بعد تغيير الكلمات)"""
+        if self._matcher is None:
+            self._matcher = KeywordMatcher(self._normalized_texts.keys())
+        return self._matcher
+    
     def _get_text_response(self, keyword, user_id):
         """الحصول على الرد وتحديث الإحصائيات"""
-        text_data = self.texts[keyword]
-        
-        # تحديث الإحصائيات
-        text_data["usage"] += 1
-        text_data["last_used"] = datetime.now().isoformat()
-        
-        self.stats["text_responses"] += 1
-        self.stats["total_responses"] += 1
-        
-        # تحديث الإحصائيات اليومية
-        today = datetime.now().strftime("%Y-%m-%d")
-        if "daily_stats" not in self.stats:
-            self.stats["daily_stats"] = {}
-        if today not in self.stats["daily_stats"]:
-            self.stats["daily_stats"][today] = {"stickers": 0, "texts": 0}
-        self.stats["daily_stats"][today]["texts"] += 1
-        
-        # تحديث إحصائيات المستخدم
-        user = self.get_or_create_user(user_id)
-        user["usage_count"] += 1
-        
-        self.save_all()
-        return text_data["response"]
+        self._count_hit("texts", keyword, user_id)
+        return self.texts[keyword]["response"]
+    
+    def _count_hit(self, kind, item_id, user_id):
+        """تسجيل الرد في العدادات المجمعة (تُدمج مع دفعة الحفظ القادمة)"""
+        self.get_or_create_user(user_id)
+        self.stats_aggregator.record(kind, item_id, user_id)
+        if not WRITE_BEHIND:
+            self.flush()
     
     # ========== الحذف والإدارة ==========
     def delete_item(self, item_type, item_id, user_id):
@@ -264,124 +1831,356 @@ class AdvancedDatabase:
             return False
         
         if item_type == "sticker" and item_id in self.stickers:
-            del self.stickers[item_id]
-            self.stats["total_stickers"] = len(self.stickers)
-            self.save_all()
+            self._commit("delete", item_type="sticker", item_id=item_id)
             return True
         
         elif item_type == "text":
             item_id_lower = item_id.lower()
             if item_id_lower in self.texts:
-                del self.texts[item_id_lower]
-                self.stats["total_texts"] = len(self.texts)
-                self.save_all()
+                self._commit("delete", item_type="text", item_id=item_id_lower)
                 return True
         
         return False
     
-    def get_all_items(self):
-        """الحصول على جميع العناصر"""
-        return {
-            "stickers": self.stickers,
-            "texts": self.texts,
-            "stats": self.stats
-        }
-    
-    def get_delete_list(self):
-        """الحصول على قائمة العناصر للحذف"""
-        items = []
-        
-        # إضافة الملصقات
-        for sticker_id, data in self.stickers.items():
-            keywords = ", ".join(data.get("keywords", []))[:20]
-            items.append({
-                "number": len(items) + 1,
-                "type": "sticker",
-                "id": sticker_id,
-                "name": f"ملصق: {keywords}"
-            })
-        
-        # إضافة النصوص
-        for keyword, data in self.texts.items():
-            response = data.get("response", "")[:20]
-            items.append({
-                "number": len(items) + 1,
-                "type": "text",
-                "id": keyword,
-                "name": f"نص: {keyword} → {response}"
-            })
-        
-        return items
+    def get_top_users(self, count):
+        """أفضل المستخدمين حسب الاستخدام: [(المعرف، البيانات)]"""
+        return [(user_key, self.users[user_key]) for user_key in self.leaderboard.top(count)]
+    
+    def get_user_rank(self, user_id):
+        """ترتيب المستخدم بين كل المستخدمين أو None"""
+        return self.leaderboard.rank(str(user_id))
+    
+    def search(self, query, limit=MAX_SEARCH_RESULTS):
+        """البحث في الكلمات والردود: [(النوع، المعرف، البيانات)] مرتبة حسب الصلة ثم الاستخدام"""
+        def usage(item_key):
+            return self._item_data(*item_key).get("usage", 0)
+        return [(*item_key, self._item_data(*item_key)) for item_key in self.search_index.search(query, limit, usage)]
+    
+    def complete(self, prefix, limit):
+        """العناصر التي تبدأ إحدى كلماتها بالبادئة: [(النوع، المعرف، البيانات)]"""
+        return [(*item_key, self._item_data(*item_key))
+                for item_key in self.prefix_index.find(normalize_text(prefix), limit)]
+    
+    def _item_data(self, item_type, item_id):
+        return self.stickers[item_id] if item_type == "sticker" else self.texts[item_id]
+    
+    def catalog_size(self):
+        """عدد كل العناصر في القائمة"""
+        return len(self._catalog)
+    
+    def get_catalog_page(self, offset, limit):
+        """عناصر صفحة من القائمة المرتبة: (الرقم، النوع، المعرف، البيانات)"""
+        page = []
+        for number, (kind, _, item_id) in enumerate(self._catalog[offset:offset + limit], offset + 1):
+            if kind == 0:
+                page.append((number, "sticker", item_id, self.stickers[item_id]))
+            else:
+                page.append((number, "text", item_id, self.texts[item_id]))
+        return page
 
-# ========== تهيئة قاعدة البيانات ==========
-db = AdvancedDatabase()
+# ========== طابور الإرسال ==========
+class TokenBucket:
+    """دلو رموز لتحديد معدل الإرسال"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now):
+        """الثواني المتبقية حتى يتوفر رمز (0 إذا كان متوفراً الآن)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+    
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
 
-# ========== دوال المساعدة ==========
-async def is_user_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """التحقق إذا كان المستخدم مشرفاً"""
-    user_id = update.effective_user.id
+class OutgoingMessage:
+    """رسالة في طابور الإرسال"""
+    
+    __slots__ = ("chat_id", "send", "priority", "seq", "not_before", "created", "key")
+    
+    def __init__(self, chat_id, send, priority, seq, not_before, key):
+        self.chat_id = chat_id
+        self.send = send
+        self.priority = priority
+        self.seq = seq
+        self.not_before = not_before
+        self.created = time.monotonic()
+        self.key = key
+
+class OutboundScheduler:
+    """طابور إرسال يحترم حدود تيليجرام
     
-    if user_id in ADMIN_IDS:
-        return True
+    دلو رموز عام (OUTBOX_GLOBAL_RATE رسالة/ثانية) ودلو لكل محادثة (OUTBOX_GROUP_RATE
+    رسالة/دقيقة للمجموعات، OUTBOX_PRIVATE_RATE رسالة/ثانية للخاص). ردود الأوامر تُرسل
+    قبل الردود التلقائية، و RetryAfter يوقف المحادثة مؤقتاً ثم يعيد المحاولة (ويوقف كل الإرسال
+    إذا وصل لمحادثتين معاً لأن السبب حينها الحد العام). الردود التلقائية المكررة أو القديمة أو
+    الزائدة عن حد الطابور تُحذف بدلاً من تأخير كل ما بعدها.
     
-    if user_id in SUPER_ADMIN_IDS:
-        return True
+    المعالجات لا تنتظر التسليم: ترتيب الطابور لكل محادثة يحفظ ترتيب الإرسال، وانتظار
+    دلو المجموعة داخل المعالج كان سيوقف كل تحديثات المحادثة.
+    """
     
-    if GROUP_ADMINS_ENABLED:
+    PRIORITY_COMMAND = 0
+    PRIORITY_AUTO = 1
+    
+    def __init__(self):
+        self._queues = {}  # chat_id ← (ردود الأوامر، الردود التلقائية)
+        self._chat_buckets = {}
+        self._paused_until = {}
+        self._global_paused_until = 0.0
+        self._global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._in_flight = set()
+        self._sending = set()  # محادثات لها رسالة قيد الإرسال
+        self.sent = 0
+        self.dropped = 0
+        self.retried = 0
+    
+    @property
+    def running(self):
+        return self._task is not None
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
         try:
-            chat = update.effective_chat
-            if chat.type in ["group", "supergroup"]:
-                member = await context.bot.get_chat_member(chat.id, user_id)
-                return member.status in ["administrator", "creator"]
-        except:
+            await self._task
+        except asyncio.CancelledError:
             pass
-    
-    return False
-
-# ========== معالجات الأوامر ==========
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """أمر البدء"""
-    user = update.effective_user
-    user_data = db.get_or_create_user(user.id, user.username, user.first_name)
-    
-    welcome_message = f"""
-🌟 **مرحباً {user.first_name}!** 🌟
-
-🤖 **{BOT_NAME} v{BOT_VERSION}**
-👤 **المستخدم:** {user_data['usage_count']} استخدام
-📅 **انضممت:** {datetime.fromisoformat(user_data['joined_date']).strftime(DATE_FORMAT)}
-{'👑 **أنت مشرف**' if user_data['is_admin'] else ''}
-
-📖 **الأوامر المتاحة:**
-/help - عرض جميع الأوامر
-/list - عرض جميع الردود
-/stats - إحصائيات البوت
-/search - البحث في الردود
+        self._task = None
+        self._queues.clear()
+    
+    async def drain(self, timeout):
+        """انتظار إرسال ما في الطابور وما قيد الإرسال، بحد أقصى timeout ثانية"""
+        deadline = time.monotonic() + timeout
+        while (self._queues or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._queues or self._in_flight:
+            pending = sum(len(queue) for queues in self._queues.values() for queue in queues)
+            logger.warning(f"انتهت مهلة تفريغ طابور الإرسال، {pending} رسالة لم تُرسل")
+    
+    def submit(self, chat_id, send, priority, delay=0.0, key=None):
+        """إضافة رسالة للطابور، send دالة تُرجع coroutine الإرسال"""
+        queue = self._queues.setdefault(chat_id, (deque(), deque()))[priority]
+        
+        if priority == self.PRIORITY_AUTO:
+            # نفس الرد التلقائي بانتظار الإرسال في هذه المحادثة يكفي مرة واحدة
+            if key is not None and any(message.key == key for message in queue):
+                self.dropped += 1
+                return
+            if len(queue) >= OUTBOX_MAX_CHAT_QUEUE:
+                queue.popleft()
+                self.dropped += 1
+        
+        self._seq += 1
+        queue.append(OutgoingMessage(chat_id, send, priority, self._seq, time.monotonic() + delay, key))
+        self._wakeup.set()
+    
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(OUTBOX_GROUP_RATE / 60, OUTBOX_GROUP_RATE)
+            else:
+                bucket = TokenBucket(OUTBOX_PRIVATE_RATE, max(1, OUTBOX_PRIVATE_RATE))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+    
+    def _drop_stale(self, queue, now):
+        while queue and now - queue[0].created > OUTBOX_STALE_SECONDS:
+            queue.popleft()
+            self.dropped += 1
+    
+    def _dispatch(self):
+        """إرسال كل ما يسمح به المعدل الآن، وإرجاع مدة الانتظار حتى الفرصة القادمة"""
+        now = time.monotonic()
+        if self._global_paused_until > now:
+            return self._global_paused_until - now
+        
+        waits = []
+        while True:
+            best = None
+            for chat_id in list(self._queues):
+                queues = self._queues[chat_id]
+                self._drop_stale(queues[self.PRIORITY_AUTO], now)
+                if not any(queues):
+                    del self._queues[chat_id]
+                    continue
+                
+                # رسالة واحدة قيد الإرسال لكل محادثة حتى يبقى ترتيب التسليم هو ترتيب الطابور
+                if chat_id in self._sending:
+                    continue
+                
+                paused = self._paused_until.get(chat_id, 0) - now
+                if paused > 0:
+                    waits.append(paused)
+                    continue
+                self._paused_until.pop(chat_id, None)
+                
+                bucket_delay = self._bucket(chat_id).delay(now)
+                if bucket_delay > 0:
+                    waits.append(bucket_delay)
+                    continue
+                
+                for queue in queues:
+                    if not queue:
+                        continue
+                    head = queue[0]
+                    if head.not_before > now:
+                        waits.append(head.not_before - now)
+                        continue
+                    if best is None or (head.priority, head.seq) < (best.priority, best.seq):
+                        best = head
+                    break
+            
+            if best is None:
+                break
+            global_delay = self._global_bucket.delay(now)
+            if global_delay > 0:
+                waits.append(global_delay)
+                break
+            
+            self._global_bucket.take(now)
+            self._bucket(best.chat_id).take(now)
+            self._queues[best.chat_id][best.priority].popleft()
+            self._sending.add(best.chat_id)
+            task = asyncio.create_task(self._deliver(best))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+        
+        # حذف دلاء المحادثات الخاملة الممتلئة
+        if len(self._chat_buckets) > 1000:
+            for chat_id in [c for c, b in self._chat_buckets.items() if c not in self._queues and b.full(now)]:
+                del self._chat_buckets[chat_id]
+        
+        return min(waits) if waits else None
+    
+    async def _run(self):
+        while True:
+            wait = self._dispatch()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _deliver(self, message):
+        try:
+            await message.send()
+            self.sent += 1
+        except RetryAfter as e:
+            # إيقاف المحادثة المدة المطلوبة وإعادة الرسالة لأول الطابور
+            self.retried += 1
+            now = time.monotonic()
+            until = now + float(e.retry_after)
+            # محادثة أخرى موقوفة بالفعل: الحد الذي تجاوزناه هو الحد العام للبوت
+            if any(paused > now for chat_id, paused in self._paused_until.items() if chat_id != message.chat_id):
+                self._global_paused_until = max(self._global_paused_until, until)
+            self._paused_until[message.chat_id] = until
+            self._queues.setdefault(message.chat_id, (deque(), deque()))[message.priority].appendleft(message)
+        except Exception as e:
+            logger.error(f"فشل إرسال رسالة إلى {message.chat_id}: {e}")
+        finally:
+            self._sending.discard(message.chat_id)
+            self._wakeup.set()
 
-👑 **أوامر للمشرفين:**
-/ss - حفظ رد للملصق
-/st - حفظ رد للكلمات
-/del - حذف عنصر
-/users - إدارة المستخدمين
-"""
-    
-    keyboard = []
-    if SHOW_HELP_BUTTON:
-        keyboard.append([InlineKeyboardButton("📖 المساعدة", callback_data="cmd_help")])
-    if SHOW_STATS_BUTTON:
-        keyboard.append([InlineKeyboardButton("📊 الإحصائيات", callback_data="cmd_stats")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard) if ENABLE_BUTTONS else None
+# ========== ذاكرة مشرفي المجموعات ==========
+class ChatAdminCache:
+    """قائمة مشرفي كل مجموعة محفوظة لمدة محددة بدلاً من سؤال تيليجرام مع كل رسالة
+    
+    القائمة تُجلب كاملة بطلب get_chat_administrators واحد، والرسائل المتزامنة في
+    نفس المجموعة تنتظر نفس الطلب. تحديثات chat_member تعدل القائمة مباشرة.
+    """
+    
+    ADMIN_STATUSES = frozenset({"administrator", "creator"})
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._chats = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+    
+    async def is_admin(self, bot, chat_id, user_id):
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            return user_id in entry[0]
+        
+        self.misses += 1
+        task = self._pending.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._pending[chat_id] = task
+        return user_id in await asyncio.shield(task)
+    
+    async def _fetch(self, bot, chat_id):
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+            admins = {member.user.id for member in members}
+            self._store(chat_id, admins)
+            return admins
+        finally:
+            del self._pending[chat_id]
+    
+    def _store(self, chat_id, admins):
+        self._chats[chat_id] = (admins, time.monotonic() + self.ttl)
+        self._chats.move_to_end(chat_id)
+        if len(self._chats) > self.maxsize:
+            self._chats.popitem(last=False)
+    
+    def update_member(self, chat_id, user_id, status):
+        """تطبيق تغيير صلاحية عضو على القائمة المحفوظة إن وجدت"""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return
+        if status in self.ADMIN_STATUSES:
+            entry[0].add(user_id)
+        else:
+            entry[0].discard(user_id)
     
-    await update.message.reply_text(
-        welcome_message, 
-        parse_mode="Markdown",
-        reply_markup=reply_markup
-    )
+    def invalidate(self, chat_id):
+        """حذف قائمة المجموعة لتُجلب من جديد عند الحاجة"""
+        self._chats.pop(chat_id, None)
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """أمر المساعدة"""
-    help_text = f"""
+# ========== عرض الردود ==========
+class ResponseRenderer:
+    """نصوص الأوامر الثابتة تُبنى مرة واحدة عند التشغيل، وعرض الإحصائيات يُحفظ لمدة قصيرة
+    
+    عرض الإحصائيات صالح ما دام رقم نسخة قاعدة البيانات لم يتغير ولم تنته مدته،
+    فالضغط المتكرر على زر الإحصائيات من مستخدمين كثيرين لا يعيد بناءه.
+    """
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._stats_view = None
+        self._stats_generation = -1
+        self._stats_expires = 0.0
+        
+        # /help كاملاً
+        self.help_text = f"""
 📚 **دليل استخدام {BOT_NAME}**
 
 **👑 أوامر المشرفين:**
@@ -390,6 +2189,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/del نوع معرف` - حذف عنصر
 • `/users` - إدارة المستخدمين
 • `/backup` - إنشاء نسخة احتياطية
+• `/restore` - استعادة نسخة احتياطية (للمالك)
 • `/settings` - إعدادات البوت
 
 **👥 أوامر عامة:**
@@ -403,35 +2203,91 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **⚙️ إعدادات البوت:**
 • الرد التلقائي: {'✅ مفعل' if ENABLE_AUTO_RESPONSE else '❌ معطل'}
 • تأخير الرد: {RESPONSE_DELAY} ثانية
-• الحد الأقصى للعناصر: {MAX_LIST_ITEMS}
+• عناصر كل صفحة: {LIST_PAGE_SIZE}
 """
-    
-    await update.message.reply_text(help_text, parse_mode="Markdown", disable_web_page_preview=True)
-
-async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """عرض الإحصائيات"""
-    stats = db.stats
-    
-    # حساب بعض الإحصائيات الإضافية
-    try:
-        start_time = datetime.fromisoformat(stats.get("start_time", datetime.now().isoformat()))
-        total_days = (datetime.now() - start_time).days
-        total_days = max(total_days, 1)
-        avg_daily = stats.get("total_responses", 0) // total_days
-    except:
-        total_days = 1
-        avg_daily = 0
-    
-    stats_message = f"""
-📊 **إحصائيات {BOT_NAME}**
-
-**📈 عام:**
-• وقت البدء: {datetime.fromisoformat(stats.get('start_time')).strftime(DATE_FORMAT) if stats.get('start_time') else 'غير معروف'}
-• أيام التشغيل: {total_days} يوم
-• متوسط يومي: {avg_daily} رد
+        
+        # الجزء الثابت من /start وأزراره
+        self.start_commands = """
+📖 **الأوامر المتاحة:**
+/help - عرض جميع الأوامر
+/list - عرض جميع الردود
+/stats - إحصائيات البوت
+/search - البحث في الردود
 
-**🎯 الردود:**
-• الكلية: {stats.get('total_responses', 0)}
+👑 **أوامر للمشرفين:**
+/ss - حفظ رد للملصق
+/st - حفظ رد للكلمات
+/del - حذف عنصر
+/users - إدارة المستخدمين
+"""
+        
+        keyboard = []
+        if SHOW_HELP_BUTTON:
+            keyboard.append([InlineKeyboardButton("📖 المساعدة", callback_data="cmd_help")])
+        if SHOW_STATS_BUTTON:
+            keyboard.append([InlineKeyboardButton("📊 الإحصائيات", callback_data="cmd_stats")])
+        
+        self.start_markup = InlineKeyboardMarkup(keyboard) if ENABLE_BUTTONS else None
+        
+        # الجزء الثابت من /settings
+        message = f"⚙️ **إعدادات {BOT_NAME}**\n\n"
+        
+        message += "**📊 الحالة:**\n"
+        message += f"• الرد التلقائي: {'✅ مفعل' if ENABLE_AUTO_RESPONSE else '❌ معطل'}\n"
+        message += f"• ردود الملصقات: {'✅ مفعل' if ENABLE_STICKER_RESPONSE else '❌ معطل'}\n"
+        message += f"• ردود النصوص: {'✅ مفعل' if ENABLE_TEXT_RESPONSE else '❌ معطل'}\n"
+        message += f"• تتبع الإحصائيات: {'✅ مفعل' if TRACK_STATS else '❌ معطل'}\n\n"
+        
+        message += "**⚙️ الإعدادات:**\n"
+        message += f"• تأخير الرد: {RESPONSE_DELAY} ثانية\n"
+        message += f"• عناصر كل صفحة: {LIST_PAGE_SIZE}\n"
+        message += f"• نتائج البحث: {MAX_SEARCH_RESULTS}\n"
+        self.settings_header = message
+    
+    def invalidate(self):
+        self._stats_view = None
+    
+    def stats_view(self):
+        """نص الإحصائيات من الذاكرة المؤقتة أو بناؤه من جديد"""
+        now = time.monotonic()
+        if self._stats_view is not None and now < self._stats_expires and self._stats_generation == db.generation:
+            return self._stats_view
+        
+        # دمج العدادات المتراكمة قد يغير رقم النسخة لذلك يُقرأ بعده
+        db.fold_stats()
+        self._stats_view = self._render_stats()
+        self._stats_generation = db.generation
+        self._stats_expires = now + self.ttl
+        return self._stats_view
+    
+    def _render_stats(self):
+        stats = db.stats
+        
+        # حساب بعض الإحصائيات الإضافية
+        try:
+            start_time = datetime.fromisoformat(stats.get("start_time", datetime.now().isoformat()))
+            total_days = (datetime.now() - start_time).days
+            total_days = max(total_days, 1)
+            avg_daily = stats.get("total_responses", 0) // total_days
+        except:
+            total_days = 1
+            avg_daily = 0
+        
+        today = datetime.now().strftime('%Y-%m-%d')
+        today_stickers, today_texts = db.timeseries.day(today)
+        week_stickers, week_texts = db.timeseries.last_days(7)
+        month_stickers, month_texts = db.timeseries.last_days(30)
+        
+        stats_message = f"""
+📊 **إحصائيات {BOT_NAME}**
+
+**📈 عام:**
+• وقت البدء: {datetime.fromisoformat(stats.get('start_time')).strftime(DATE_FORMAT) if stats.get('start_time') else 'غير معروف'}
+• أيام التشغيل: {total_days} يوم
+• متوسط يومي: {avg_daily} رد
+
+**🎯 الردود:**
+• الكلية: {stats.get('total_responses', 0)}
 • للملصقات: {stats.get('sticker_responses', 0)}
 • للنصوص: {stats.get('text_responses', 0)}
 
@@ -440,80 +2296,212 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • الملصقات: {stats.get('total_stickers', 0)}
 • النصوص: {stats.get('total_texts', 0)}
 
-**📅 اليوم ({datetime.now().strftime('%Y-%m-%d')}):**
-• الملصقات: {stats.get('daily_stats', {}).get(datetime.now().strftime('%Y-%m-%d'), {}).get('stickers', 0)}
-• النصوص: {stats.get('daily_stats', {}).get(datetime.now().strftime('%Y-%m-%d'), {}).get('texts', 0)}
+**📅 اليوم ({today}):**
+• الملصقات: {today_stickers}
+• النصوص: {today_texts}
+
+**🗓️ الفترات:**
+• آخر 7 أيام: {week_stickers + week_texts} رد
+• آخر 30 يوم: {month_stickers + month_texts} رد
 """
-    
-    if SHOW_TOP_USERS > 0:
-        # الحصول على أفضل المستخدمين
-        users_list = []
-        for user_id, user_data in db.users.items():
-            if isinstance(user_data, dict):
-                users_list.append((user_id, user_data))
         
-        users_sorted = sorted(
-            users_list,
-            key=lambda x: x[1].get("usage_count", 0),
-            reverse=True
-        )[:SHOW_TOP_USERS]
+        histogram = db.timeseries.hour_histogram()
+        if any(histogram):
+            peak = max(range(24), key=histogram.__getitem__)
+            stats_message += f"• توزيع الساعات: `{sparkline(histogram)}`\n• أنشط ساعة: {peak:02d}:00 ({histogram[peak]} رد)\n"
+        
+        if SHOW_TOP_USERS > 0:
+            # الحصول على أفضل المستخدمين
+            users_sorted = db.get_top_users(SHOW_TOP_USERS)
+        
+            if users_sorted:
+                stats_message += "\n**🏆 أفضل المستخدمين:**\n"
+                for i, (user_id, user_data) in enumerate(users_sorted, 1):
+                    name = user_data.get("first_name", "مستخدم")
+                    stats_message += f"{i}. {name}: {user_data.get('usage_count', 0)} استخدام\n"
         
-        if users_sorted:
-            stats_message += "\n**🏆 أفضل المستخدمين:**\n"
-            for i, (user_id, user_data) in enumerate(users_sorted, 1):
-                name = user_data.get("first_name", "مستخدم")
-                stats_message += f"{i}. {name}: {user_data.get('usage_count', 0)} استخدام\n"
+        return stats_message
+
+# ========== تهيئة قاعدة البيانات ==========
+db = AdvancedDatabase()
+outbox = OutboundScheduler()
+backups = BackupEngine(BACKUP_DIR)
+exporter = StateExporter(LocalDirectorySink(EXPORT_DIR), EXPORT_KEEP)
+admin_cache = ChatAdminCache(ADMIN_CACHE_SIZE, ADMIN_CACHE_TTL)
+renderer = ResponseRenderer(STATS_VIEW_TTL)
+
+# ========== دوال المساعدة ==========
+async def reply(update: Update, text, **kwargs):
+    """إضافة رد الأمر لطابور الإرسال (قبل الردود التلقائية) دون انتظار تسليمه"""
+    message = update.effective_message
+    send = lambda: message.reply_text(text, **kwargs)
+    
+    if outbox.running:
+        outbox.submit(message.chat_id, send, OutboundScheduler.PRIORITY_COMMAND)
+    else:
+        await send()
+
+def sparkline(values):
+    """رسم مصغر للقيم بحروف الأعمدة"""
+    bars = "▁▂▃▄▅▆▇█"
+    top = max(values) or 1
+    return "".join(bars[value * (len(bars) - 1) // top] for value in values)
+
+async def is_user_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """التحقق إذا كان المستخدم مشرفاً"""
+    user_id = update.effective_user.id
+    
+    if user_id in ADMIN_IDS:
+        return True
+    
+    if user_id in SUPER_ADMIN_IDS:
+        return True
+    
+    if GROUP_ADMINS_ENABLED:
+        try:
+            chat = update.effective_chat
+            if chat.type in ["group", "supergroup"]:
+                return await admin_cache.is_admin(context.bot, chat.id, user_id)
+        except Exception as e:
+            logger.warning(f"تعذر جلب مشرفي المجموعة: {e}")
+    
+    return False
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تحديث ذاكرة المشرفين عند ترقية عضو أو تنزيله"""
+    change = update.chat_member or update.my_chat_member
+    status = change.new_chat_member.status
+    if update.my_chat_member and status not in ChatAdminCache.ADMIN_STATUSES:
+        # البوت خرج أو فقد الإشراف فلن تصله تحديثات chat_member وقد تتقادم القائمة
+        admin_cache.invalidate(change.chat.id)
+        return
+    admin_cache.update_member(change.chat.id, change.new_chat_member.user.id, status)
+
+# ========== معالجات الأوامر ==========
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أمر البدء"""
+    user = update.effective_user
+    user_data = db.get_or_create_user(user.id, user.username, user.first_name)
     
-    await update.message.reply_text(stats_message, parse_mode="Markdown", disable_web_page_preview=True)
+    welcome_message = f"""
+🌟 **مرحباً {user.first_name}!** 🌟
 
-async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """عرض القائمة"""
-    try:
-        items = db.get_all_items()
-        
-        # عرض الملصقات
-        stickers_msg = "🎨 **الملصقات:**\n"
-        if items["stickers"]:
-            for sid, data in items["stickers"].items():
-                keywords = ", ".join(data.get("keywords", []))
-                usage = data.get("usage", 0)
-                stickers_msg += f"\n🆔 **{sid}**\n🔑 {keywords}\n📊 استخدم: {usage} مرة\n"
+🤖 **{BOT_NAME} v{BOT_VERSION}**
+👤 **المستخدم:** {user_data['usage_count']} استخدام
+📅 **انضممت:** {datetime.fromisoformat(user_data['joined_date']).strftime(DATE_FORMAT)}
+{'👑 **أنت مشرف**' if user_data['is_admin'] else ''}
+{renderer.start_commands}"""
+    
+    await reply(
+        update,
+        welcome_message, 
+        parse_mode="Markdown",
+        reply_markup=renderer.start_markup
+    )
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أمر المساعدة"""
+    await reply(update, renderer.help_text, parse_mode="Markdown", disable_web_page_preview=True)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض الإحصائيات"""
+    await reply(update, renderer.stats_view(), parse_mode="Markdown", disable_web_page_preview=True)
+
+def _shorten(text, limit):
+    """قص النص الطويل مع إضافة ..."""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def page_markup(prefix, offset, total):
+    """أزرار التنقل بين الصفحات (السابق / التالي)"""
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("◀️ السابق", callback_data=f"{prefix}:{max(offset - LIST_PAGE_SIZE, 0)}"))
+    if offset + LIST_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton("التالي ▶️", callback_data=f"{prefix}:{offset + LIST_PAGE_SIZE}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def page_header(title, offset, total):
+    pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    return f"{title} ({offset // LIST_PAGE_SIZE + 1}/{pages}) - {total} عنصر\n"
+
+def render_list_page(offset):
+    """نص صفحة من /list وأزرارها، تُبنى عند الطلب من الفهرس المرتب"""
+    total = db.catalog_size()
+    if not total:
+        return "📋 **القائمة فارغة حالياً**", None
+    offset = min(max(offset, 0), (total - 1) // LIST_PAGE_SIZE * LIST_PAGE_SIZE)
+    
+    lines = [page_header("📋 **القائمة**", offset, total)]
+    for number, item_type, item_id, data in db.get_catalog_page(offset, LIST_PAGE_SIZE):
+        usage = data.get("usage", 0)
+        if item_type == "sticker":
+            keywords = escape_markdown(_shorten(", ".join(data.get("keywords", [])), 60))
+            lines.append(f"{number}. 🎨 **{escape_markdown(item_id)}**\n🔑 {keywords}\n📊 استخدم: {usage} مرة")
         else:
-            stickers_msg += "لا توجد ملصقات\n"
-        
-        # عرض النصوص
-        texts_msg = "\n💬 **النصوص:**\n"
-        if items["texts"]:
-            for kw, data in items["texts"].items():
-                response = data.get("response", "")[:30]
-                if len(data.get("response", "")) > 30:
-                    response += "..."
-                usage = data.get("usage", 0)
-                texts_msg += f"\n🔑 **{kw}**\n💬 {response}\n📊 استخدم: {usage} مرة\n"
+            response = escape_markdown(_shorten(data.get("response", ""), 30))
+            lines.append(f"{number}. 💬 **{escape_markdown(_shorten(item_id, 60))}**\n{response}\n📊 استخدم: {usage} مرة")
+    return "\n".join(lines), page_markup("list", offset, total)
+
+def render_delete_page(offset):
+    """نص صفحة من /del وأزرارها"""
+    total = db.catalog_size()
+    offset = min(max(offset, 0), max(total - 1, 0) // LIST_PAGE_SIZE * LIST_PAGE_SIZE)
+    
+    lines = [page_header("🗑️ **اختر رقم العنصر للحذف:**", offset, total)]
+    for number, item_type, item_id, data in db.get_catalog_page(offset, LIST_PAGE_SIZE):
+        if item_type == "sticker":
+            name = f"ملصق: {', '.join(data.get('keywords', []))[:20]}"
         else:
-            texts_msg += "لا توجد نصوص\n"
-        
-        # إرسال الرسائل
-        await update.message.reply_text(stickers_msg, parse_mode="Markdown", disable_web_page_preview=True)
-        await asyncio.sleep(0.3)
-        await update.message.reply_text(texts_msg, parse_mode="Markdown", disable_web_page_preview=True)
-        
-    except Exception as e:
-        logger.error(f"خطأ في /list: {e}")
-        await update.message.reply_text("📋 **القائمة فارغة حالياً**", disable_web_page_preview=True)
+            name = f"نص: {item_id[:20]} → {data.get('response', '')[:20]}"
+        lines.append(f"{number}. {escape_markdown(name)}")
+    lines.append("\n📝 **للحذف اكتب:**\n`/delnum <الرقم>`\nمثال: `/delnum 1`")
+    return "\n".join(lines), page_markup("del", offset, total)
+
+async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض القائمة صفحة صفحة (/list أو /list رقم_الصفحة)"""
+    db.fold_stats()
+    page = 1
+    if context.args and context.args[0].isdigit():
+        page = max(int(context.args[0]), 1)
+    
+    text, markup = render_list_page((page - 1) * LIST_PAGE_SIZE)
+    await reply(update, text, parse_mode="Markdown", reply_markup=markup, disable_web_page_preview=True)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """البحث في الكلمات والردود (/search كلمة)"""
+    if not context.args:
+        await reply(update, "❌ اكتب كلمة للبحث!\n📝 مثال: /search مرحبا", disable_web_page_preview=True)
+        return
+    
+    query = " ".join(context.args)
+    results = db.search(query)
+    if not results:
+        await reply(update, f"🔍 لا توجد نتائج لـ: {query}", disable_web_page_preview=True)
+        return
+    
+    lines = [f"🔍 **نتائج البحث:** {escape_markdown(_shorten(query, 50))}\n"]
+    for i, (item_type, item_id, data) in enumerate(results, 1):
+        response = escape_markdown(_shorten(data.get("response", ""), 50))
+        if item_type == "sticker":
+            keywords = escape_markdown(_shorten(", ".join(data.get("keywords", [])), 60))
+            lines.append(f"{i}. 🎨 **{keywords}**\n{response}")
+        else:
+            lines.append(f"{i}. 💬 **{escape_markdown(_shorten(data.get('keyword', item_id), 60))}**\n{response}")
+    await reply(update, "\n".join(lines), parse_mode="Markdown", disable_web_page_preview=True)
 
 # ========== حفظ الملصقات والنصوص ==========
 async def save_sticker_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """بدء عملية حفظ ملصق"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
         return
     
     # وضع المستخدم في حالة انتظار الملصق
     context.user_data["save_mode"] = "sticker"
     context.user_data["save_step"] = 1
     
-    await update.message.reply_text(
+    await reply(
+        update,
         "🎨 **حفظ رد نصي للملصق**\n\n"
         "📤 **الخطوة 1 من 3:**\n"
         "أرسل الملصق الذي تريد ربط رد نصي به...",
@@ -523,11 +2511,12 @@ async def save_sticker_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def save_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """بدء عملية حفظ نص"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
         return
     
     if not context.args:
-        await update.message.reply_text(
+        await reply(
+            update,
             "❌ يجب تحديد الكلمات المفتاحية!\n"
             "📝 الاستخدام: /st كلمة1,كلمة2,كلمة3",
             disable_web_page_preview=True
@@ -537,7 +2526,7 @@ async def save_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keywords = [k.strip() for k in " ".join(context.args).split(",") if k.strip()]
     
     if not keywords:
-        await update.message.reply_text("❌ يجب كتابة كلمات مفتاحية صحيحة!", disable_web_page_preview=True)
+        await reply(update, "❌ يجب كتابة كلمات مفتاحية صحيحة!", disable_web_page_preview=True)
         return
     
     # وضع المستخدم في حالة انتظار النص
@@ -545,7 +2534,8 @@ async def save_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["save_step"] = 2
     context.user_data["keywords"] = keywords
     
-    await update.message.reply_text(
+    await reply(
+        update,
         f"📝 **حفظ رد نصي**\n\n"
         f"🔑 الكلمات المفتاحية: {', '.join(keywords)}\n"
         f"📤 **الخطوة 2 من 2:**\n"
@@ -554,6 +2544,16 @@ async def save_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # ========== معالجة الرسائل ==========
+async def send_auto_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    """إضافة الرد التلقائي لطابور الإرسال، التأخير يؤخر هذا الرد وحده ولا يوقف المعالج"""
+    message = update.message
+    send = lambda: message.reply_text(text, allow_sending_without_reply=True, disable_web_page_preview=True)
+    
+    if outbox.running:
+        outbox.submit(message.chat_id, send, OutboundScheduler.PRIORITY_AUTO, delay=RESPONSE_DELAY, key=text)
+    else:
+        await send()
+
 async def handle_sticker_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة الملصقات المرسلة"""
     # التحقق إذا كان مشرف
@@ -566,9 +2566,11 @@ async def handle_sticker_message(update: Update, context: ContextTypes.DEFAULT_T
     # الحالة 1: المستخدم في وضع حفظ الملصق (الخطوة 1)
     if context.user_data.get("save_mode") == "sticker" and context.user_data.get("save_step") == 1:
         context.user_data["sticker_file_id"] = sticker.file_id
+        context.user_data["sticker_file_unique_id"] = sticker.file_unique_id
         context.user_data["save_step"] = 2
         
-        await update.message.reply_text(
+        await reply(
+            update,
             "✅ **تم استلام الملصق!**\n\n"
             "📝 **الخطوة 2 من 3:**\n"
             "اكتب الكلمات المفتاحية لهذا الملصق\n"
@@ -579,11 +2581,9 @@ async def handle_sticker_message(update: Update, context: ContextTypes.DEFAULT_T
     
     # الحالة 2: البحث عن رد للملصق المرسل
     if ENABLE_AUTO_RESPONSE and ENABLE_STICKER_RESPONSE:
-        response = db.find_sticker_response(sticker.file_id, user.id)
+        response = db.find_sticker_response(sticker.file_id, user.id, sticker.file_unique_id)
         if response:
-            if RESPONSE_DELAY > 0:
-                await asyncio.sleep(RESPONSE_DELAY)
-            await update.message.reply_text(response, disable_web_page_preview=True)
+            await send_auto_reply(update, context, response)
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة النصوص المرسلة"""
@@ -603,13 +2603,14 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         keywords = [k.strip() for k in message_text.split(",") if k.strip()]
         
         if not keywords:
-            await update.message.reply_text("❌ يجب كتابة كلمات مفتاحية صحيحة!", disable_web_page_preview=True)
+            await reply(update, "❌ يجب كتابة كلمات مفتاحية صحيحة!", disable_web_page_preview=True)
             return
         
         context.user_data["keywords"] = keywords
         context.user_data["save_step"] = 3
         
-        await update.message.reply_text(
+        await reply(
+            update,
             "✅ **تم حفظ الكلمات المفتاحية!**\n\n"
             "💬 **الخطوة 3 من 3:**\n"
             "اكتب النص الذي تريد ربطه بهذا الملصق\n"
@@ -626,14 +2627,16 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.user_data.get("sticker_file_id"),
             context.user_data.get("keywords", []),
             message_text,
-            user.id
+            user.id,
+            context.user_data.get("sticker_file_unique_id")
         )
         
         # تنظيف بيانات المستخدم
-        for key in ["save_mode", "save_step", "sticker_file_id", "keywords"]:
+        for key in ["save_mode", "save_step", "sticker_file_id", "sticker_file_unique_id", "keywords"]:
             context.user_data.pop(key, None)
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f"🎉 **تم الحفظ بنجاح!** 🎉\n\n"
             f"🆔 **المعرف:** {sticker_id}\n"
             f"🔑 **الكلمات:** {', '.join(context.user_data.get('keywords', []))}\n"
@@ -653,14 +2656,15 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             for key in ["save_mode", "save_step", "keywords"]:
                 context.user_data.pop(key, None)
             
-            await update.message.reply_text(
+            await reply(
+                update,
                 f"✅ **تم حفظ الرد النصي!**\n\n"
                 f"🔑 **الكلمات:** {', '.join(keywords)}\n"
                 f"💬 **الرد:** {message_text[:50]}{'...' if len(message_text) > 50 else ''}",
                 disable_web_page_preview=True
             )
         else:
-            await update.message.reply_text("❌ فشل في حفظ الرد!", disable_web_page_preview=True)
+            await reply(update, "❌ فشل في حفظ الرد!", disable_web_page_preview=True)
         return
     
     # ========== البحث عن رد تلقائي ==========
@@ -669,81 +2673,81 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         response = db.find_text_response(message_text, user.id)
         
         if response:
-            if RESPONSE_DELAY > 0:
-                await asyncio.sleep(RESPONSE_DELAY)
-            await update.message.reply_text(response, disable_web_page_preview=True)
+            await send_auto_reply(update, context, response)
 
 # ========== الحذف بالأرقام ==========
 async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """حذف عنصر"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
         return
     
-    # الحصول على جميع العناصر
-    items = db.get_delete_list()
-    
-    if not items:
-        await update.message.reply_text("📭 لا توجد عناصر للحذف!", disable_web_page_preview=True)
+    if not db.catalog_size():
+        await reply(update, "📭 لا توجد عناصر للحذف!", disable_web_page_preview=True)
         return
     
-    # حفظ القائمة في بيانات المستخدم
-    context.user_data["delete_items"] = items
-    
-    # إنشاء رسالة القائمة
-    list_message = "🗑️ **اختر رقم العنصر للحذف:**\n\n"
-    for item in items:
-        list_message += f"{item['number']}. {item['name']}\n"
+    # يكفي حفظ نسخة الفهرس: الأرقام صالحة ما دام الفهرس لم يتغير
+    context.user_data.pop("delete_items", None)
+    context.user_data["delete_version"] = db.catalog_version
     
-    list_message += f"\n📝 **للحذف اكتب:**\n`/delnum <الرقم>`\nمثال: `/delnum 1`"
-    
-    await update.message.reply_text(list_message, parse_mode="Markdown", disable_web_page_preview=True)
+    text, markup = render_delete_page(0)
+    await reply(update, text, parse_mode="Markdown", reply_markup=markup, disable_web_page_preview=True)
 
 async def delete_number_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """حذف عنصر باستخدام الرقم"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        return
+    
+    if "delete_version" not in context.user_data:
+        await reply(update, "❌ استخدم /del أولاً لعرض القائمة!", disable_web_page_preview=True)
         return
     
-    if "delete_items" not in context.user_data:
-        await update.message.reply_text("❌ استخدم /del أولاً لعرض القائمة!", disable_web_page_preview=True)
+    if context.user_data["delete_version"] != db.catalog_version:
+        context.user_data.pop("delete_version", None)
+        await reply(update, "🔄 تغيرت القائمة منذ عرضها، استخدم /del مرة أخرى!", disable_web_page_preview=True)
         return
     
     if not context.args:
-        await update.message.reply_text("❌ يجب تحديد رقم!\n📝 مثال: /delnum 1", disable_web_page_preview=True)
+        await reply(update, "❌ يجب تحديد رقم!\n📝 مثال: /delnum 1", disable_web_page_preview=True)
         return
     
     try:
         item_number = int(context.args[0])
-        items = context.user_data["delete_items"]
         
-        if 1 <= item_number <= len(items):
-            item = items[item_number - 1]
+        if 1 <= item_number <= db.catalog_size():
+            _, item_type, item_id, data = db.get_catalog_page(item_number - 1, 1)[0]
+            if item_type == "sticker":
+                name = f"ملصق: {', '.join(data.get('keywords', []))[:20]}"
+            else:
+                name = f"نص: {item_id} → {data.get('response', '')[:20]}"
             
-            if db.delete_item(item["type"], item["id"], update.effective_user.id):
+            if db.delete_item(item_type, item_id, update.effective_user.id):
                 # تنظيف بيانات المستخدم
-                context.user_data.pop("delete_items", None)
+                context.user_data.pop("delete_version", None)
                 
-                await update.message.reply_text(
+                await reply(
+                    update,
                     f"✅ **تم الحذف بنجاح!**\n"
-                    f"🗑️ **العنصر المحذوف:** {item['name']}",
+                    f"🗑️ **العنصر المحذوف:** {name}",
                     disable_web_page_preview=True
                 )
             else:
-                await update.message.reply_text(f"❌ فشل في حذف العنصر رقم {item_number}", disable_web_page_preview=True)
+                await reply(update, f"❌ فشل في حذف العنصر رقم {item_number}", disable_web_page_preview=True)
         else:
-            await update.message.reply_text(f"❌ الرقم {item_number} غير صالح!", disable_web_page_preview=True)
+            await reply(update, f"❌ الرقم {item_number} غير صالح!", disable_web_page_preview=True)
     
     except ValueError:
-        await update.message.reply_text("❌ يجب إدخال رقم صحيح!", disable_web_page_preview=True)
+        await reply(update, "❌ يجب إدخال رقم صحيح!", disable_web_page_preview=True)
 
 # ========== أوامر إضافية ==========
 async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة المستخدمين"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
         return
     
+    db.fold_stats()
     users = db.users
     total_users = len(users)
     
@@ -751,16 +2755,7 @@ async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message += f"📊 إجمالي المستخدمين: {total_users}\n\n"
     
     # عرض أفضل 10 مستخدمين
-    users_list = []
-    for user_id, user_data in users.items():
-        if isinstance(user_data, dict):
-            users_list.append((user_id, user_data))
-    
-    users_sorted = sorted(
-        users_list,
-        key=lambda x: x[1].get("usage_count", 0),
-        reverse=True
-    )[:10]
+    users_sorted = db.get_top_users(10)
     
     if users_sorted:
         message += "🏆 **أفضل المستخدمين:**\n"
@@ -770,10 +2765,11 @@ async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             usage = user_data.get("usage_count", 0)
             message += f"{i}. {name} (@{username}): {usage} استخدام\n"
     
-    await update.message.reply_text(message, parse_mode="Markdown", disable_web_page_preview=True)
+    await reply(update, message, parse_mode="Markdown", disable_web_page_preview=True)
 
 async def myinfo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معلومات المستخدم"""
+    db.fold_stats()
     user = update.effective_user
     user_data = db.get_or_create_user(user.id, user.username, user.first_name)
     
@@ -784,64 +2780,106 @@ async def myinfo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += f"📱 **اليوزر:** @{user.username}\n"
     message += f"📅 **تاريخ الانضمام:** {datetime.fromisoformat(user_data.get('joined_date')).strftime(DATE_FORMAT)}\n"
     message += f"🔄 **عدد الاستخدامات:** {user_data.get('usage_count', 0)}\n"
+    rank = db.get_user_rank(user.id)
+    if rank:
+        message += f"🏅 **ترتيبك:** {rank} من {len(db.leaderboard)}\n"
     message += f"🎨 **الملصقات المحفوظة:** {user_data.get('stickers_saved', 0)}\n"
     message += f"💬 **النصوص المحفوظة:** {user_data.get('texts_saved', 0)}\n"
     message += f"👑 **الحالة:** {'مشرف' if user_data.get('is_admin', False) else 'مستخدم عادي'}\n"
     
-    await update.message.reply_text(message, parse_mode="Markdown", disable_web_page_preview=True)
+    await reply(update, message, parse_mode="Markdown", disable_web_page_preview=True)
 
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """نسخ احتياطي"""
     if not await is_user_admin(update, context):
-        await update.message.reply_text("⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
+        await reply(update, "⛔️ هذا الأمر للمشرفين فقط!", disable_web_page_preview=True)
         return
     
     try:
         # حفظ جميع البيانات أولاً
+        db.fold_stats()
         db.save_all()
         
-        # إنشاء نسخة احتياطية يدوية
-        backup_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(BACKUP_DIR, backup_time)
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        files_to_backup = [
-            (STICKERS_FILE, "stickers.json"),
-            (TEXTS_FILE, "texts.json"),
-            (USERS_FILE, "users.json"),
-            (STATS_FILE, "stats.json")
-        ]
+        # الضغط والبصمات في خيط منفصل حتى لا تتوقف الردود
+        snapshot = await asyncio.to_thread(backups.create, db.storage.files())
+        removed = await asyncio.to_thread(backups.prune, BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY)
         
-        import shutil
-        for source, filename in files_to_backup:
-            if os.path.exists(source):
-                shutil.copy2(source, os.path.join(backup_dir, filename))
+        if snapshot is None:
+            await reply(update, f"✅ لا توجد تغييرات منذ آخر نسخة ({backups.latest()})", disable_web_page_preview=True)
+            return
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ **تم إنشاء نسخة احتياطية!**\n\n"
-            f"📂 **المجلد:** {backup_dir}\n"
+            f"📂 **النسخة:** {snapshot['name']}\n"
             f"🕒 **الوقت:** {datetime.now().strftime(DATE_FORMAT)}\n"
-            f"📊 **الملفات:** {len(files_to_backup)} ملف",
+            f"📊 **الملفات:** {snapshot['files']} ملف ({snapshot['bytes_written'] // 1024} KB جديدة)\n"
+            f"🧹 **نسخ قديمة محذوفة:** {removed}",
             disable_web_page_preview=True
         )
     except Exception as e:
         logger.error(f"خطأ في النسخ الاحتياطي: {e}")
-        await update.message.reply_text("❌ فشل في إنشاء النسخة الاحتياطية!", disable_web_page_preview=True)
+        await reply(update, "❌ فشل في إنشاء النسخة الاحتياطية!", disable_web_page_preview=True)
 
-async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """إعدادات البوت"""
-    message = f"⚙️ **إعدادات {BOT_NAME}**\n\n"
+def reload_database(contents):
+    """استبدال ملفات قاعدة البيانات بمحتوى تم التحقق منه ثم إعادة تحميلها
+    
+    بدون انتظار بين الإغلاق والتحميل حتى لا يصل تحديث لقاعدة مغلقة.
+    """
+    global db
+    db.close()
+    backups.restore(contents)
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    db = AdvancedDatabase()
+    renderer.invalidate()
+
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """استعادة نسخة احتياطية (/restore أو /restore اسم_النسخة)"""
+    if update.effective_user.id not in SUPER_ADMIN_IDS:
+        await reply(update, "⛔️ هذا الأمر للمالك فقط!", disable_web_page_preview=True)
+        return
+    
+    names = backups.snapshots()
+    if not names:
+        await reply(update, "📭 لا توجد نسخ احتياطية!", disable_web_page_preview=True)
+        return
+    
+    if not context.args:
+        message = "🗄️ **النسخ الاحتياطية:**\n\n" + "\n".join(f"• `{name}`" for name in names[-10:])
+        message += "\n\n📝 **للاستعادة:** `/restore <النسخة>` أو `/restore latest`"
+        await reply(update, message, parse_mode="Markdown", disable_web_page_preview=True)
+        return
+    
+    name = names[-1] if context.args[0] == "latest" else context.args[0]
+    if name not in names:
+        await reply(update, f"❌ النسخة {name} غير موجودة!", disable_web_page_preview=True)
+        return
     
-    message += "**📊 الحالة:**\n"
-    message += f"• الرد التلقائي: {'✅ مفعل' if ENABLE_AUTO_RESPONSE else '❌ معطل'}\n"
-    message += f"• ردود الملصقات: {'✅ مفعل' if ENABLE_STICKER_RESPONSE else '❌ معطل'}\n"
-    message += f"• ردود النصوص: {'✅ مفعل' if ENABLE_TEXT_RESPONSE else '❌ معطل'}\n"
-    message += f"• تتبع الإحصائيات: {'✅ مفعل' if TRACK_STATS else '❌ معطل'}\n\n"
+    try:
+        contents = await asyncio.to_thread(backups.verify, name)
+    except Exception as e:
+        logger.error(f"فشل التحقق من النسخة {name}: {e}")
+        await reply(update, f"❌ النسخة {name} تالفة، لم تتم الاستعادة!", disable_web_page_preview=True)
+        return
     
-    message += "**⚙️ الإعدادات:**\n"
-    message += f"• تأخير الرد: {RESPONSE_DELAY} ثانية\n"
-    message += f"• الحد الأقصى للعناصر: {MAX_LIST_ITEMS}\n"
-    message += f"• نتائج البحث: {MAX_SEARCH_RESULTS}\n\n"
+    reload_database(contents)
+    
+    await reply(
+        update,
+        f"✅ **تمت الاستعادة من {name}**\n"
+        f"🎨 {len(db.stickers)} ملصق | 💬 {len(db.texts)} نص | 👥 {len(db.users)} مستخدم",
+        disable_web_page_preview=True
+    )
+
+async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إعدادات البوت"""
+    message = renderer.settings_header
+    cache_stats = db.resolution_cache.stats()
+    message += f"• ذاكرة المطابقة: {cache_stats['hits']} إصابة / {cache_stats['misses']} إخفاق ({cache_stats['hit_rate']:.0%})\n"
+    if GROUP_ADMINS_ENABLED:
+        message += f"• ذاكرة المشرفين: {admin_cache.hits} إصابة / {admin_cache.misses} إخفاق\n"
+    message += "\n"
     
     message += "**📁 التخزين:**\n"
     stats = db.stats
@@ -849,7 +2887,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message += f"• النصوص: {stats.get('total_texts', 0)}\n"
     message += f"• المستخدمين: {stats.get('total_users', 0)}\n"
     
-    await update.message.reply_text(message, parse_mode="Markdown", disable_web_page_preview=True)
+    await reply(update, message, parse_mode="Markdown", disable_web_page_preview=True)
 
 # ========== معالج الاستدعاء ==========
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -865,12 +2903,66 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await help_command(update, context)
         elif data == "cmd_stats":
             await stats_command(update, context)
+        elif data.startswith(("list:", "del:")):
+            await page_callback(update, context)
         else:
             await query.edit_message_text("⚙️ أمر غير معروف", disable_web_page_preview=True)
     except Exception as e:
         logger.error(f"خطأ في معالج الاستدعاء: {e}")
         await query.message.reply_text("⚠️ حدث خطأ في معالجة الطلب", disable_web_page_preview=True)
 
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """التنقل بين صفحات /list و /del بتعديل نفس الرسالة"""
+    query = update.callback_query
+    prefix, _, offset = query.data.partition(":")
+    
+    if prefix == "del":
+        if not await is_user_admin(update, context):
+            return
+        context.user_data["delete_version"] = db.catalog_version
+        text, markup = render_delete_page(int(offset))
+    else:
+        text, markup = render_list_page(int(offset))
+    
+    try:
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup, disable_web_page_preview=True)
+    except BadRequest as e:
+        # الضغط على نفس الصفحة مرتين لا يغير الرسالة
+        if "not modified" not in str(e).lower():
+            raise
+
+# ========== وضع الإنلاين ==========
+# آخر استعلام لكل مستخدم، الاستعلامات الأقدم منه لا يُجاب عليها
+_inline_latest = {}
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """استقبال استعلام @bot وتأجيل الإجابة قليلاً لتجميع الكتابة المتتابعة"""
+    query = update.inline_query
+    _inline_latest[query.from_user.id] = query.id
+    # مهمة مستقلة حتى لا يشغل الانتظار مكاناً في المعالجة المتوازية
+    context.application.create_task(answer_inline_query(query), update=update)
+
+async def answer_inline_query(query):
+    """الإجابة على آخر استعلام للمستخدم من فهرس البادئات"""
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if _inline_latest.get(query.from_user.id) != query.id:
+        return
+    del _inline_latest[query.from_user.id]
+    
+    results = []
+    for item_type, item_id, data in db.complete(query.query, INLINE_MAX_RESULTS):
+        title = ", ".join(data.get("keywords", [])) if item_type == "sticker" else data.get("keyword", item_id)
+        response = data.get("response", "")
+        results.append(InlineQueryResultArticle(
+            id=str(len(results)),
+            title=_shorten(title, 60),
+            description=_shorten(response, 100),
+            input_message_content=InputTextMessageContent(response)
+        ))
+    
+    # النتائج لا تختلف بين المستخدمين فيحفظها تيليجرام ويجيب منها مباشرة
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
 # ========== معالج الأخطاء ==========
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج الأخطاء العام"""
@@ -879,31 +2971,315 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if SHOW_ERRORS_TO_USER:
         try:
             if update and update.message:
-                await update.message.reply_text("⚠️ حدث خطأ، تم تسجيله.", disable_web_page_preview=True)
+                await reply(update, "⚠️ حدث خطأ، تم تسجيله.", disable_web_page_preview=True)
         except:
             pass
 
-# ========== الدالة الرئيسية ==========
-def main():
-    """تشغيل البوت"""
-    print(f"🚀 بدء تشغيل {BOT_NAME} v{BOT_VERSION}")
-    print(f"👤 المطور: {BOT_CREATOR}")
-    print("=" * 50)
-    print("⚙️ الإعدادات النشطة:")
-    print(f"• الرد التلقائي: {'✅' if ENABLE_AUTO_RESPONSE else '❌'}")
-    print(f"• تأخير الرد: {RESPONSE_DELAY} ثانية")
-    print(f"• أزرار تفاعلية: {'✅' if ENABLE_BUTTONS else '❌'}")
-    print(f"• إحصائيات: {'✅' if TRACK_STATS else '❌'}")
-    print("=" * 50)
+# ========== المعالجة المتوازية للتحديثات ==========
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """معالجة تحديثات المحادثات المختلفة بالتوازي مع الحفاظ على الترتيب داخل كل محادثة
+    
+    كل تحديث يأخذ قفل محادثته وقفل مستخدمه (بترتيب ثابت لتجنب التعارض)، فخطوات
+    /ss و /st لنفس المستخدم لا تتداخل. أقفال asyncio تخدم المنتظرين بترتيب وصولهم.
+    قاعدة البيانات لا تحتاج قفلاً: كل تعديلاتها متزامنة وتعمل في حلقة asyncio فقط.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = Counter()
+    
+    @staticmethod
+    def _ordering_keys(update):
+        keys = []
+        if isinstance(update, Update):
+            if update.effective_chat:
+                keys.append(("chat", update.effective_chat.id))
+            if update.effective_user:
+                keys.append(("user", update.effective_user.id))
+        return sorted(set(keys))
+    
+    async def process_update(self, update, coroutine):
+        keys = self._ordering_keys(update)
+        for key in keys:
+            self._waiting[key] += 1
+            self._locks.setdefault(key, asyncio.Lock())
+        
+        try:
+            async with AsyncExitStack() as stack:
+                # الأقفال قبل حد التوازي حتى لا تشغل محادثة واحدة كل الأماكن
+                for key in keys:
+                    await stack.enter_async_context(self._locks[key])
+                await super().process_update(update, coroutine)
+        finally:
+            for key in keys:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+                    del self._locks[key]
+    
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+# ========== استكمال التحديثات بعد إعادة التشغيل ==========
+async def resume_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تجاهل التحديثات المعالجة قبل إعادة التشغيل والرسائل القديمة جداً
+    
+    يعمل في المجموعة -1 قبل كل المعالجات. رقم آخر تحديث ووقته يُحفظان في bot_data مع
+    حالة المستخدمين، فلا يُرد على نفس الرسالة مرتين إذا أعاد تيليجرام إرسالها.
+    
+    الرقم يُستخدم فقط لدفعة الاستكمال: تيليجرام يبدأ الترقيم من رقم عشوائي بعد أسبوع
+    بلا تحديثات، فالتحديث الأقدم رقماً يُعتبر جديداً إذا كان بعيداً عن آخر رقم
+    (أكثر من RESUME_ID_WINDOW) أو كان تاريخه بعد آخر تحديث معالج.
+    """
+    if not isinstance(update, Update):
+        return
     
-    # إنشاء التطبيق
-    app = Application.builder().token(TOKEN).build()
+    # الأزرار تحمل تاريخ الرسالة الأصلية لذلك يُفحص تاريخ الرسائل الجديدة فقط
+    message = update.message or update.edited_message
+    sent_at = (message.edit_date or message.date) if message else None
+    
+    resume_after = context.bot_data.get("resume_after", 0)
+    if update.update_id <= resume_after:
+        related = resume_after - update.update_id < RESUME_ID_WINDOW
+        resume_time = context.bot_data.get("resume_time")
+        if related and (sent_at is None or resume_time is None or sent_at.timestamp() <= resume_time):
+            raise ApplicationHandlerStop
+        # ترقيم جديد: لا استكمال بعد الآن، والرقم المحفوظ يتبع الترقيم الجديد
+        logger.info(f"بدأ تيليجرام ترقيماً جديداً للتحديثات من {update.update_id}")
+        context.bot_data["resume_after"] = 0
+        context.bot_data["last_update_id"] = 0
+    if update.update_id > context.bot_data.get("last_update_id", 0):
+        context.bot_data["last_update_id"] = update.update_id
+        context.bot_data["last_update_time"] = time.time()
+    
+    if sent_at and STALE_UPDATE_SECONDS:
+        age = (datetime.now(sent_at.tzinfo) - sent_at).total_seconds()
+        if age > STALE_UPDATE_SECONDS:
+            logger.debug(f"تجاهل تحديث قديم {update.update_id} ({int(age)} ثانية)")
+            raise ApplicationHandlerStop
+
+# ========== الحفظ الدوري ==========
+async def flush_job(context: ContextTypes.DEFAULT_TYPE):
+    """حفظ التعديلات المؤجلة على القرص"""
+    db.flush()
+
+def export_paths():
+    """الملفات التي يشملها التصدير: قاعدة البيانات وحالة المستخدمين"""
+    return db.storage.files() + ([STATE_FILE] if WARM_START else [])
+
+async def export_job(context: ContextTypes.DEFAULT_TYPE):
+    """تصدير دوري لكل البيانات (الضغط والكتابة في خيط منفصل)"""
+    db.fold_stats()
+    db.save_all()
+    await context.application.update_persistence()
+    try:
+        result = await asyncio.to_thread(exporter.export, export_paths())
+        logger.info(f"تم التصدير إلى {result['name']} ({result['files']} ملف، {result['bytes'] // 1024} KB)")
+    except Exception as e:
+        logger.error(f"فشل التصدير: {e}")
+
+def restore_on_cold_start():
+    """استعادة آخر أرشيف تصدير إذا بدأ البوت بقاعدة بيانات فارغة (تشغيل جديد)"""
+    if db.users or db.catalog_size():
+        return
+    
+    started = time.perf_counter()
+    try:
+        loaded = exporter.load_latest()
+    except Exception as e:
+        logger.error(f"تعذرت قراءة أرشيف التصدير: {e}")
+        return
+    if loaded is None:
+        return
+    
+    name, contents = loaded
+    reload_database(contents)
+    logger.info(
+        f"تمت الاستعادة من {name} في {time.perf_counter() - started:.2f} ثانية "
+        f"({len(db.stickers)} ملصق، {len(db.texts)} نص، {len(db.users)} مستخدم)"
+    )
+
+async def post_init(application: Application):
+    """تشغيل طابور الإرسال وتحديد نقطة الاستكمال"""
+    application.bot_data["resume_after"] = application.bot_data.get("last_update_id", 0)
+    application.bot_data["resume_time"] = application.bot_data.get("last_update_time")
+    outbox.start()
+
+async def post_stop(application: Application):
+    """إرسال الردود المتبقية في الطابور ثم إيقافه، قبل أن يُغلق اتصال البوت"""
+    await outbox.drain(OUTBOX_DRAIN_TIMEOUT)
+    await outbox.stop()
+
+async def post_shutdown(application: Application):
+    """حفظ أي تعديلات متبقية قبل الإغلاق"""
+    paths = export_paths() if ENABLE_EXPORT else []
+    db.close()
+    
+    # تصدير أخير حتى لا يضيع شيء عند انتهاء التشغيل
+    if paths:
+        try:
+            exporter.export(paths)
+        except Exception as e:
+            logger.error(f"فشل التصدير الأخير: {e}")
+
+# ========== استقبال التحديثات عبر Webhook ==========
+class WebhookServer:
+    """خادم HTTP خفيف يستقبل تحديثات تيليجرام ويمررها للتطبيق مباشرة
+    
+    يتحقق من ترويسة X-Telegram-Bot-Api-Secret-Token ثم يضع التحديث في update_queue ويرد
+    فوراً، فلا يتجاوز الطلب مهلة تيليجرام وهو ينتظر أقفال المحادثة أو طابور الإرسال
+    (وإلا أعاد تيليجرام إرسال التحديث نفسه). wait_for_processing يؤخر الرد حتى انتهاء
+    المعالجة، لأداة القياس فقط.
+    """
+    
+    MAX_BODY = 1024 * 1024
+    MAX_HEADERS = 100
+    
+    def __init__(self, application, path, secret, wait_for_processing=False, read_timeout=WEBHOOK_READ_TIMEOUT):
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self.wait_for_processing = wait_for_processing
+        self.read_timeout = read_timeout
+        self._server = None
+    
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+    
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    async def _read(self, read):
+        return await asyncio.wait_for(read, timeout=self.read_timeout)
+    
+    async def _handle(self, reader, writer):
+        try:
+            method, target, _ = (await self._read(reader.readline())).decode("latin-1").split(" ", 2)
+            headers = {}
+            for _ in range(self.MAX_HEADERS + 1):
+                line = await self._read(reader.readline())
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            else:
+                raise ValueError("too many headers")
+            
+            length = int(headers.get("content-length", 0))
+            if length > self.MAX_BODY:
+                status = "413 Payload Too Large"
+            else:
+                status = await self._dispatch(method, target, headers, await self._read(reader.readexactly(length)))
+        except asyncio.TimeoutError:
+            status = "408 Request Timeout"
+        except (ValueError, asyncio.IncompleteReadError):
+            status = "400 Bad Request"
+        
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    async def _dispatch(self, method, target, headers, body):
+        if method != "POST" or target != self.path:
+            return "404 Not Found"
+        # بدون سر يمكن لأي أحد يعرف الرابط إرسال تحديثات مزورة باسم المالك
+        if not self.secret or not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", ""), self.secret
+        ):
+            return "403 Forbidden"
+        
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            return "400 Bad Request"
+        
+        if self.wait_for_processing:
+            # عبر معالج التحديثات حتى يبقى الترتيب داخل المحادثة وحد التوازي
+            await self.application.update_processor.process_update(update, self.application.process_update(update))
+        else:
+            await self.application.update_queue.put(update)
+        return "200 OK"
+
+async def run_webhook(app: Application):
+    """تشغيل البوت بوضع webhook حتى استقبال إشارة الإيقاف"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    # سر عشوائي لهذا التشغيل إذا لم يُحدد، يُرسل لتيليجرام مع set_webhook
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(app, f"/{WEBHOOK_PATH}", secret, WEBHOOK_WAIT_FOR_PROCESSING)
+    try:
+        async with app:
+            await post_init(app)
+            await app.start()
+            await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+            await app.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=not WARM_START
+            )
+            logger.info(f"Webhook يستمع على {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+            try:
+                await stop.wait()
+            finally:
+                await server.stop()
+                await app.stop()
+                await post_stop(app)
+    finally:
+        # بعد إغلاق التطبيق حتى تكون حالة المستخدمين قد حُفظت، كما في polling
+        await post_shutdown(app)
+
+# ========== الدالة الرئيسية ==========
+def build_application(bot=None):
+    """إنشاء التطبيق وتسجيل كل المعالجات (bot: كائن Bot جاهز بدلاً من التوكن، لأدوات القياس)"""
+    builder = Application.builder().post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    if bot is not None:
+        builder.bot(bot)
+    else:
+        builder.token(TOKEN)
+    if WARM_START:
+        # حالة خطوات الحفظ (user_data) ورقم آخر تحديث تبقى بعد إعادة التشغيل
+        builder.persistence(PicklePersistence(
+            STATE_FILE,
+            store_data=PersistenceInput(chat_data=False, callback_data=False),
+            update_interval=FLUSH_INTERVAL
+        ))
+    if CONCURRENT_UPDATES > 1:
+        builder.concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+    app = builder.build()
+    
+    # جدولة الحفظ المؤجل
+    if WRITE_BEHIND:
+        app.job_queue.run_repeating(flush_job, interval=FLUSH_INTERVAL, first=FLUSH_INTERVAL)
+    
+    # جدولة التصدير الدوري
+    if ENABLE_EXPORT:
+        app.job_queue.run_repeating(export_job, interval=EXPORT_INTERVAL, first=EXPORT_INTERVAL)
+    
+    # تصفية التحديثات قبل كل المعالجات
+    app.add_handler(TypeHandler(Update, resume_filter), group=-1)
     
     # إضافة معالجات الأوامر
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CommandHandler("list", list_command))
+    app.add_handler(CommandHandler("search", search_command))
     app.add_handler(CommandHandler("ss", save_sticker_command))
     app.add_handler(CommandHandler("st", save_text_command))
     app.add_handler(CommandHandler("del", delete_command))
@@ -911,6 +3287,7 @@ def main():
     app.add_handler(CommandHandler("users", users_command))
     app.add_handler(CommandHandler("myinfo", myinfo_command))
     app.add_handler(CommandHandler("backup", backup_command))
+    app.add_handler(CommandHandler("restore", restore_command))
     app.add_handler(CommandHandler("settings", settings_command))
     
     # إضافة معالجات الرسائل
@@ -920,18 +3297,55 @@ def main():
     # إضافة معالج الاستدعاء (للأزرار)
     app.add_handler(CallbackQueryHandler(callback_handler))
     
+    # وضع الإنلاين (@bot كلمة)
+    app.add_handler(InlineQueryHandler(inline_query_handler))
+    
+    # تغييرات صلاحيات الأعضاء
+    app.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+    
     # إضافة معالج الأخطاء
     app.add_error_handler(error_handler)
+    return app
+
+def main():
+    """تشغيل البوت"""
+    print(f"🚀 بدء تشغيل {BOT_NAME} v{BOT_VERSION}")
+    print(f"👤 المطور: {BOT_CREATOR}")
+    print("=" * 50)
+    print("⚙️ الإعدادات النشطة:")
+    print(f"• الرد التلقائي: {'✅' if ENABLE_AUTO_RESPONSE else '❌'}")
+    print(f"• تأخير الرد: {RESPONSE_DELAY} ثانية")
+    print(f"• أزرار تفاعلية: {'✅' if ENABLE_BUTTONS else '❌'}")
+    print(f"• إحصائيات: {'✅' if TRACK_STATS else '❌'}")
+    print(f"• المعالجة المتوازية: {'✅ ' + str(CONCURRENT_UPDATES) + ' تحديث' if CONCURRENT_UPDATES > 1 else '❌'}")
+    print(f"• الحفظ المؤجل: {'✅ كل ' + str(FLUSH_INTERVAL) + ' ثانية' if WRITE_BEHIND else '❌'}")
+    print(f"• الاستكمال بعد إعادة التشغيل: {'✅' if WARM_START else '❌'}")
+    print(f"• الاستقبال: {'Webhook' if UPDATE_MODE == 'webhook' and WEBHOOK_URL else 'Polling'}")
+    print(f"• التصدير التلقائي: {'✅ كل ' + str(EXPORT_INTERVAL) + ' ثانية' if ENABLE_EXPORT else '❌'}")
+    print("=" * 50)
+    
+    # استعادة البيانات في التشغيل الجديد قبل تحميل حالة المستخدمين
+    if ENABLE_EXPORT:
+        restore_on_cold_start()
+    
+    # إنشاء التطبيق
+    app = build_application()
     
     print(f"✅ {BOT_NAME} يعمل الآن!")
     print("💡 استخدم /start للبدء")
     print("👑 استخدم /help لمعرفة الأوامر")
     
     # بدء الاستقبال
+    if UPDATE_MODE == "webhook":
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(app))
+            return
+        logger.warning("WEBHOOK_URL غير محدد، التشغيل بوضع polling")
+    
     app.run_polling(
         poll_interval=POLL_INTERVAL,
         allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True
+        drop_pending_updates=not WARM_START
     )
     
 if __name__ == "__main__":
@@ -945,246 +3359,4 @@ if __name__ == "__main__":
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump({}, f, ensure_ascii=False, indent=2)
     
-    main()# ========== قاعدة البيانات المتقدمة ==========
-class AdvancedDatabase:
-    def __init__(self):
-        self.stickers = self._safe_load(STICKERS_FILE)
-        self.texts = self._safe_load(TEXTS_FILE)
-        self.users = self._safe_load(USERS_FILE)
-        self.stats = self._safe_load(STATS_FILE)
-        self._initialize_stats()
-        
-    def _safe_load(self, filename):
-        try:
-            if os.path.exists(filename):
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict):
-                        return data
-            return {}
-        except Exception as e:
-            logger.error(f"خطأ في تحميل {filename}: {e}")
-            return {}
-
-    def _save_file(self, data, filename):
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            logger.error(f"خطأ في حفظ {filename}: {e}")
-            return False
-
-    def _initialize_stats(self):
-        required_stats = {
-            "start_time": datetime.now().isoformat(),
-            "total_users": 0,
-            "total_stickers": len(self.stickers),
-            "total_texts": len(self.texts),
-            "total_responses": 0,
-            "sticker_responses": 0,
-            "text_responses": 0,
-            "daily_stats": {},
-            "user_stats": {}
-        }
-        
-        for key, value in required_stats.items():
-            if key not in self.stats:
-                self.stats[key] = value
-        
-        self._save_file(self.stats, STATS_FILE)
-
-    def save_all(self):
-        self._save_file(self.stickers, STICKERS_FILE)
-        self._save_file(self.texts, TEXTS_FILE)
-        self._save_file(self.users, USERS_FILE)
-        self._save_file(self.stats, STATS_FILE)
-        return True
-
-    def get_or_create_user(self, user_id, username="", first_name=""):
-        user_key = str(user_id)
-        
-        if user_key not in self.users:
-            self.users[user_key] = {
-                "id": user_id,
-                "username": username,
-                "first_name": first_name,
-                "joined_date": datetime.now().isoformat(),
-                "usage_count": 0,
-                "stickers_saved": 0,
-                "texts_saved": 0,
-                "last_active": datetime.now().isoformat(),
-                "is_admin": user_id in ADMIN_IDS,
-                "is_blocked": user_id in BLOCKED_USERS,
-                "language": BOT_LANGUAGE
-            }
-            self.stats["total_users"] = len(self.users)
-            self.save_all()
-        
-        self.users[user_key]["last_active"] = datetime.now().isoformat()
-        return self.users[user_key]
-
-    def find_sticker_response(self, file_id, user_id):
-        """البحث عن رد نصي للملصق"""
-        for sticker_id, data in self.stickers.items():
-            if data.get("file_id") == file_id:
-                data["usage"] += 1
-                data["last_used"] = datetime.now().isoformat()
-                
-                self.stats["sticker_responses"] += 1
-                self.stats["total_responses"] += 1
-                
-                user = self.get_or_create_user(user_id)
-                user["usage_count"] += 1
-                
-                self.save_all()
-                return data["response"]
-        
-        return None
-
-    def find_text_response(self, message, user_id):
-        """البحث عن رد نصي للكلمات"""
-        msg_lower = message.strip().lower()
-        
-        if msg_lower in self.texts:
-            return self._get_text_response(msg_lower, user_id)
-        
-        words = re.findall(r'[\w\u0600-\u06FF]+', msg_lower)
-        for word in words:
-            if word in self.texts:
-                return self._get_text_response(word, user_id)
-        
-        return None
-    
-    def _get_text_response(self, keyword, user_id):
-        text_data = self.texts[keyword]
-        
-        text_data["usage"] += 1
-        text_data["last_used"] = datetime.now().isoformat()
-        
-        self.stats["text_responses"] += 1
-        self.stats["total_responses"] += 1
-        
-        user = self.get_or_create_user(user_id)
-        user["usage_count"] += 1
-        
-        self.save_all()
-        return text_data["response"]
-
-# ========== دوال المساعدة ==========
-async def is_user_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """التحقق إذا كان المستخدم مشرفاً"""
-    user_id = update.effective_user.id
-    
-    if user_id in ADMIN_IDS:
-        return True
-    
-    if user_id in SUPER_ADMIN_IDS:
-        return True
-    
-    if GROUP_ADMINS_ENABLED:
-        try:
-            chat = update.effective_chat
-            if chat.type in ["group", "supergroup"]:
-                member = await context.bot.get_chat_member(chat.id, user_id)
-                return member.status in ["administrator", "creator"]
-        except:
-            pass
-    
-    return False
-
-# ========== معالجات الأوامر ==========
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """أمر البدء"""
-    user = update.effective_user
-    user_data = db.get_or_create_user(user.id, user.username, user.first_name)
-    
-    welcome_message = f"""
-🌟 **مرحباً {user.first_name}!** 🌟
-
-🤖 **{BOT_NAME} v{BOT_VERSION}**
-👤 **المستخدم:** {user_data['usage_count']} استخدام
-📅 **انضممت:** {datetime.fromisoformat(user_data['joined_date']).strftime(DATE_FORMAT)}
-{'👑 **أنت مشرف**' if user_data['is_admin'] else ''}
-
-📖 **الأوامر المتاحة:**
-/help - عرض جميع الأوامر
-/list - عرض جميع الردود
-/stats - إحصائيات البوت
-/search - البحث في الردود
-
-👑 **أوامر للمشرفين:**
-/ss - حفظ رد للملصق
-/st - حفظ رد للكلمات
-/del - حذف عنصر
-/users - إدارة المستخدمين
-"""
-    
-    keyboard = []
-    if SHOW_HELP_BUTTON:
-        keyboard.append([InlineKeyboardButton("📖 المساعدة", callback_data="cmd_help")])
-    if SHOW_STATS_BUTTON:
-        keyboard.append([InlineKeyboardButton("📊 الإحصائيات", callback_data="cmd_stats")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard) if ENABLE_BUTTONS else None
-    
-    await update.message.reply_text(
-        welcome_message, 
-        parse_mode="Markdown",
-        reply_markup=reply_markup
-    )
-
-async def handle_sticker_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة الملصقات المرسلة"""
-    user = update.effective_user
-    sticker = update.message.sticker
-    
-    # منع الرد على غير المشرفين
-    if not await is_user_admin(update, context):
-        return
-    
-    if ENABLE_AUTO_RESPONSE and ENABLE_STICKER_RESPONSE:
-        response = db.find_sticker_response(sticker.file_id, user.id)
-        if response:
-            await update.message.reply_text(response, disable_web_page_preview=True)
-
-async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة النصوص المرسلة"""
-    user = update.effective_user
-    message_text = update.message.text
-    
-    # منع الرد على غير المشرفين
-    if not await is_user_admin(update, context):
-        return
-    
-    if ENABLE_AUTO_RESPONSE and ENABLE_TEXT_RESPONSE:
-        response = db.find_text_response(message_text, user.id)
-        if response:
-            await update.message.reply_text(response, disable_web_page_preview=True)
-
-# ========== دالة التشغيل ==========
-def main():
-    """تشغيل البوت"""
-    try:
-        print(f"🚀 بدء تشغيل {BOT_NAME} v{BOT_VERSION}")
-        
-        app = Application.builder().token(TOKEN).build()
-        
-        # إضافة معالجات الأوامر
-        app.add_handler(CommandHandler("start", start_command))
-        
-        # إضافة معالجات الرسائل
-        app.add_handler(MessageHandler(filters.Sticker.ALL, handle_sticker_message))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-        
-        app.run_polling(
-            poll_interval=POLL_INTERVAL,
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
-    
-    except Exception as e:
-        logger.error(f"خطأ في تشغيل البوت: {e}")
-
-if __name__ == "__main__":
     main()
@@ -1,3 +1,5 @@
+import os
+
 # إعدادات البوت
 BOT_NAME = "بوت ٣ ثانوي ازهر ٢٠٢٦"
 BOT_VERSION = "2.0.0"
@@ -10,18 +12,72 @@ TEXTS_FILE = f"{DATA_DIR}/texts.json"
 USERS_FILE = f"{DATA_DIR}/users.json"
 STATS_FILE = f"{DATA_DIR}/stats.json"
 BACKUP_DIR = f"{DATA_DIR}/backups"
+JOURNAL_FILE = f"{DATA_DIR}/journal.jsonl"
+FLUSH_COMMIT_FILE = f"{DATA_DIR}/flush.commit"
+SQLITE_FILE = f"{DATA_DIR}/bot.db"
+STATE_FILE = f"{DATA_DIR}/state.pickle"
+EXPORT_DIR = "exports"  # خارج data حتى يمكن حفظه بين تشغيلات GitHub Actions
 
 # إعدادات البوت
 ENABLE_AUTO_RESPONSE = True
 ENABLE_STICKER_RESPONSE = True
 ENABLE_TEXT_RESPONSE = True
 RESPONSE_DELAY = 0.5
-MAX_LIST_ITEMS = 50
+LIST_PAGE_SIZE = 10  # عدد العناصر في كل صفحة من /list و /del
+INLINE_MAX_RESULTS = 20  # أقصى عدد نتائج في وضع الإنلاين
+INLINE_CACHE_TIME = 60  # مدة حفظ تيليجرام لنتائج الإنلاين بالثواني
+INLINE_DEBOUNCE = 0.3  # انتظار توقف الكتابة قبل الإجابة بالثواني
 MAX_SEARCH_RESULTS = 10
 POLL_INTERVAL = 1.0
+OUTBOX_GLOBAL_RATE = 30  # رسالة/ثانية لكل البوت
+OUTBOX_GROUP_RATE = 20  # رسالة/دقيقة لكل مجموعة
+OUTBOX_PRIVATE_RATE = 1  # رسالة/ثانية لكل محادثة خاصة
+OUTBOX_MAX_CHAT_QUEUE = 20  # أقصى عدد ردود تلقائية منتظرة في المحادثة الواحدة
+OUTBOX_STALE_SECONDS = 30  # حذف الرد التلقائي إذا انتظر أكثر من ذلك
+OUTBOX_DRAIN_TIMEOUT = 10  # أقصى مدة لإرسال الردود المتبقية عند الإيقاف
+CONCURRENT_UPDATES = 32  # أقصى عدد تحديثات تُعالج معاً (1 = بالترتيب)، الترتيب محفوظ داخل كل محادثة
+
+# إعدادات الاستقبال: "polling" أو "webhook"
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # الرابط العام للبوت، فارغ = polling
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = int(os.environ.get("PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # يُرسل في ترويسة X-Telegram-Bot-Api-Secret-Token، فارغ = سر عشوائي لكل تشغيل
+WEBHOOK_READ_TIMEOUT = 10.0  # أقصى مدة لقراءة كل جزء من الطلب قبل إغلاق الاتصال
+WEBHOOK_WAIT_FOR_PROCESSING = os.environ.get("WEBHOOK_WAIT_FOR_PROCESSING") == "1"  # للقياس فقط: الرد بعد انتهاء المعالجة
+
+# إعدادات الحفظ
+STORAGE_BACKEND = "json"  # "json" أو "sqlite"
+WRITE_BEHIND = True  # حفظ مؤجل بدلاً من إعادة كتابة الملفات مع كل رسالة
+FLUSH_INTERVAL = 10.0  # الثواني بين كل دفعة حفظ
+FLUSH_DIRTY_THRESHOLD = 200  # حفظ فوري بعد هذا العدد من التعديلات
+USER_ACTIVITY_INTERVAL = 300  # الثواني بين كل حفظ لأوقات نشاط المستخدمين
+JOURNAL_FSYNC = False  # مزامنة السجل مع القرص بعد كل تعديل (أبطأ وأكثر أماناً)
+
+# إعدادات النسخ الاحتياطي (آخر نسخة في كل ساعة/يوم/أسبوع)
+BACKUP_KEEP_HOURLY = 24
+BACKUP_KEEP_DAILY = 7
+BACKUP_KEEP_WEEKLY = 8
+
+# إعدادات التصدير (لأجهزة التشغيل المؤقتة)
+ENABLE_EXPORT = True  # تصدير دوري لكل البيانات واستعادتها عند التشغيل بقاعدة فارغة
+EXPORT_INTERVAL = 1800  # الثواني بين كل تصدير
+EXPORT_KEEP = 3  # عدد الأرشيفات المحفوظة
+
+# إعدادات إعادة التشغيل
+WARM_START = True  # استكمال الرسائل المعلقة وحالة المستخدمين بدلاً من حذفها عند إعادة التشغيل
+STALE_UPDATE_SECONDS = 900  # عدم الرد على الرسائل الأقدم من ذلك عند الاستكمال (0 = الرد على الكل)
+RESUME_ID_WINDOW = 1000  # التحديث الأقدم رقماً من آخر تحديث بأكثر من ذلك يعني أن تيليجرام بدأ ترقيماً جديداً
+
+# إعدادات الإحصائيات
+STATS_RETENTION_DAYS = 90  # الأيام المحفوظة بالتفصيل، الأقدم تُجمع أسبوعياً وشهرياً
+STATS_HOURLY_DAYS = 7  # الأيام المحفوظ توزيع ساعاتها
+STATS_WEEKLY_RETENTION = 52  # الأسابيع المحفوظة، الأقدم تبقى في المجاميع الشهرية فقط
+STATS_VIEW_TTL = 15  # مدة حفظ نص /stats الجاهز بالثواني
 
 # الإدارة - كل الأدمن إليك
-ADMIN_IDS = [
+ADMIN_IDS = frozenset({
     1525269399,  # 👑 أنت (حسين) - المالك
     7163835091,  # 👨‍💼 أدمن 1
     5336094844,  # 👨‍💼 أدمن 2  
@@ -31,11 +87,13 @@ ADMIN_IDS = [
     3855620820,  # 👨‍💼 أدمن 7
     2703417038,  # 👨‍💼 أدمن 8
     2177316369,  # 👨‍💼 أدمن 9
-]
+})
 
-SUPER_ADMIN_IDS = [1525269399]  # 👑 أنت فقط سوبر أدمن
-BLOCKED_USERS = []
+SUPER_ADMIN_IDS = frozenset({1525269399})  # 👑 أنت فقط سوبر أدمن
+BLOCKED_USERS = frozenset()
 GROUP_ADMINS_ENABLED = False
+ADMIN_CACHE_TTL = 600  # مدة حفظ قائمة مشرفي المجموعة بالثواني
+ADMIN_CACHE_SIZE = 1000  # أقصى عدد مجموعات محفوظة
 
 # إعدادات إضافية
 SHOW_HELP_BUTTON = True
@@ -45,6 +103,11 @@ ENABLE_BUTTONS = True
 TRACK_STATS = True
 SHOW_ERRORS_TO_USER = False
 FUZZY_SEARCH = True
+APPROXIMATE_SEARCH = True  # مطابقة الكلمات رغم الأخطاء الإملائية
+FUZZY_THRESHOLD = 0.8  # أقل نسبة تشابه مقبولة (0 - 1)
+FUZZY_MAX_CANDIDATES = 20  # أقصى عدد مرشحين يُحسب لهم مسافة التحرير
+RESOLUTION_CACHE_SIZE = 2048  # عدد الرسائل المحفوظة نتيجة مطابقتها
+RESOLUTION_CACHE_TTL = 3600  # مدة صلاحية النتيجة بالثواني
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 # اللغة
@@ -0,0 +1,12 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# bot.py يقرأ التوكن وينشئ قاعدة البيانات عند الاستيراد، فيعمل في مجلد مؤقت
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+_workdir = tempfile.mkdtemp(prefix="bot-tests-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.chdir(_workdir)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
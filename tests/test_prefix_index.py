@@ -0,0 +1,53 @@
+import pytest
+
+import bot
+
+ITEMS = [
+    (("text", "جدول الامتحانات"), ["جدول الامتحانات"]),
+    (("text", "الاجازة"), ["الإجازة"]),
+    (("sticker", "sticker_1"), ["ال"]),
+]
+
+
+def find(index, prefix):
+    return index.find(bot.normalize_text(prefix), 10)
+
+
+@pytest.fixture(params=["add", "build"])
+def index(request):
+    index = bot.PrefixIndex()
+    if request.param == "build":
+        index.build(ITEMS)
+    else:
+        for item_key, keywords in ITEMS:
+            index.add(item_key, keywords)
+    return index
+
+
+@pytest.mark.parametrize("prefix", ["جدول", "جدول الا", "الامت", "امتح", "امتحانات"])
+def test_word_and_article_stripped_prefixes_match(index, prefix):
+    assert find(index, prefix) == [("text", "جدول الامتحانات")]
+
+
+def test_query_is_normalized(index):
+    assert find(index, "إجاز") == [("text", "الاجازة")]
+
+
+def test_short_word_is_not_stripped_to_nothing(index):
+    # "ال" وحدها لا تُختصر إلى كلمة فارغة تطابق كل شيء
+    assert ("sticker", "sticker_1") in find(index, "ال")
+    assert find(index, "ز") == []
+
+
+def test_remove_drops_all_terms(index):
+    index.remove(("text", "جدول الامتحانات"))
+    assert find(index, "امتح") == []
+    assert find(index, "جدول") == []
+
+
+def test_database_completion_after_reload():
+    db = bot.AdvancedDatabase()
+    db.add_text_response(["جدول الامتحانات"], "الجدول", min(bot.SUPER_ADMIN_IDS))
+    db.flush()
+    reloaded = bot.AdvancedDatabase()
+    assert [item_id for _, item_id, _ in reloaded.complete("امتح", 5)] == ["جدول الامتحانات"]
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+import bot
+
+NOW = int(time.time())
+
+
+def message_update(update_id, date, edit_date=None):
+    message = {
+        "message_id": update_id,
+        "date": date,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "test"},
+        "text": "hi"
+    }
+    if edit_date is None:
+        return Update.de_json({"update_id": update_id, "message": message}, None)
+    message["edit_date"] = edit_date
+    return Update.de_json({"update_id": update_id, "edited_message": message}, None)
+
+
+def run(update, bot_data):
+    """True إذا مر التحديث من المرشح"""
+    try:
+        asyncio.run(bot.resume_filter(update, SimpleNamespace(bot_data=bot_data)))
+    except ApplicationHandlerStop:
+        return False
+    return True
+
+
+def resumed(last_update_id=5000, seconds_ago=60):
+    return {"resume_after": last_update_id, "last_update_id": last_update_id, "resume_time": NOW - seconds_ago}
+
+
+def test_already_processed_update_is_dropped():
+    assert not run(message_update(4990, NOW - 120), resumed())
+
+
+def test_newer_update_passes():
+    bot_data = resumed()
+    assert run(message_update(5001, NOW), bot_data)
+    assert bot_data["last_update_id"] == 5001
+
+
+def test_restarted_numbering_far_below_is_accepted():
+    bot_data = resumed()
+    assert run(message_update(12, NOW), bot_data)
+    assert bot_data["resume_after"] == 0
+    assert bot_data["last_update_id"] == 12
+    assert run(message_update(13, NOW), bot_data)
+
+
+def test_restarted_numbering_close_below_is_accepted_by_date():
+    assert run(message_update(4990, NOW), resumed())
+
+
+def test_edit_is_judged_by_edit_date():
+    # رسالة قديمة عُدلت الآن: ليست مكررة ولا قديمة
+    bot_data = resumed(seconds_ago=60)
+    assert run(message_update(4995, NOW - 7200, edit_date=NOW), bot_data)
+
+
+@pytest.mark.parametrize("edit_date", [None, NOW - 7200])
+def test_stale_messages_are_dropped(edit_date):
+    date = NOW - 10000
+    assert not run(message_update(1, date, edit_date=edit_date), {})
@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+import bot
+
+UPDATE = json.dumps({"update_id": 1}).encode()
+
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+async def post(secret, header=None):
+    """إرسال تحديث لخادم webhook مؤقت وإرجاع سطر الحالة وعدد التحديثات المقبولة"""
+    app = FakeApplication()
+    server = bot.WebhookServer(app, "/telegram", secret)
+    await server.start("127.0.0.1", 0)
+    port = server._server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        request = f"POST /telegram HTTP/1.1\r\nContent-Length: {len(UPDATE)}\r\n"
+        if header is not None:
+            request += f"X-Telegram-Bot-Api-Secret-Token: {header}\r\n"
+        writer.write(request.encode() + b"\r\n" + UPDATE)
+        status = (await reader.readline()).decode().strip()
+        writer.close()
+        return status, app.update_queue.qsize()
+    finally:
+        await server.stop()
+
+
+def test_missing_secret_header_is_forbidden():
+    assert asyncio.run(post("s3cret")) == ("HTTP/1.1 403 Forbidden", 0)
+
+
+def test_wrong_secret_header_is_forbidden():
+    assert asyncio.run(post("s3cret", "guess")) == ("HTTP/1.1 403 Forbidden", 0)
+
+
+def test_server_without_secret_rejects_everything():
+    assert asyncio.run(post("", "")) == ("HTTP/1.1 403 Forbidden", 0)
+
+
+def test_valid_secret_queues_update():
+    assert asyncio.run(post("s3cret", "s3cret")) == ("HTTP/1.1 200 OK", 1)